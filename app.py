@@ -1,16 +1,24 @@
 print("--- 脚本开始 ---")
 
+import time
+STARTUP_STARTED_AT = time.perf_counter()
 import sys
 import os
 import threading
 import datetime
 import json
 import re
-from flask import Flask, render_template, request, jsonify
-from waitress import serve
+import math
+import heapq
+import queue
+from contextlib import contextmanager
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, render_template, request, jsonify
 from dotenv import load_dotenv
-import praw
-import google.generativeai as genai
+from cachetools import TTLCache
+# praw 和 google.generativeai 导入较慢，推迟到第一次真正需要客户端时再加载 (见 get_reddit_client / get_gemini_model)
 
 print(f"--- 正在使用 Python 版本: {sys.version} ---")
 print(f"--- 当前工作目录: {os.getcwd()} ---")
@@ -29,72 +37,550 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 # --- 全局配置 ---
 SUBREDDITS_TO_SEARCH = "homeimprovement+interiordesign+Apartmentliving+malelivingspace+femalelivingspace+homeautomation"
-STATUS_FILE = "task_status.json"
-TOTAL_CHARS_LIMIT = 30000
+# 任务调度配置：同时运行的任务数、排队上限、保留的历史任务数，以及用于重启恢复的任务快照文件
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "10"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "100"))
+JOBS_FILE = os.getenv("JOBS_FILE", "task_jobs.json")
+JOB_PERSIST = os.getenv("JOB_PERSIST", "1") == "1"
+# 进度推送 (SSE)：每条推送连接都会占用一个 waitress 线程，因此限制同时打开的连接数，超出时前端回退到轮询
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "4"))
+SSE_HEARTBEAT_SECONDS = 15
+# AI 分析分块配置：每块的 token 预算 (按约 4 个字符 1 个 token 估算)、最多分块数
+# 各块同时提交，实际并发由下方的 GEMINI_MAX_CONCURRENT_CALLS 全局限制
+ANALYSIS_CHUNK_TOKENS = int(os.getenv("ANALYSIS_CHUNK_TOKENS", "7500"))
+MAX_ANALYSIS_CHUNKS = int(os.getenv("MAX_ANALYSIS_CHUNKS", "12"))
+# 进程内所有任务同时发往 Gemini 的请求总数上限 (批量运行时多个任务共享)
+GEMINI_MAX_CONCURRENT_CALLS = int(os.getenv("GEMINI_MAX_CONCURRENT_CALLS", "8"))
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash")
+# 冷启动预算 (毫秒)：模块加载 + 任务快照恢复超过该值时打印警告，实际耗时通过 /metrics 暴露
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "500"))
+# 常驻进程 (python app.py) 启动后在后台预先加载客户端，避免第一个任务承担导入和初始化的耗时
+PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS", "1") == "1"
+CHARS_PER_TOKEN = 4
+COMMENT_EXAMPLES_PER_ITEM = 2
+# 评论预筛选：过短评论的最少词数、近似重复判定阈值 (估计的 Jaccard 相似度)
+MIN_COMMENT_WORDS = int(os.getenv("MIN_COMMENT_WORDS", "4"))
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.8"))
+CHART_COLORS = ["#D2B48C", "#E9DDC7", "#856404", "#C8A27A", "#A67B5B", "#F0E2C8", "#6F4E37", "#BFA58A"]
 # 默认屏蔽词列表现在在这里定义
 DEFAULT_BLOCKED_KEYWORDS = ["shower", "politics", "trump", "war", "navy", "smoke", "military", "game"]
+# Reddit 并发抓取配置：并发线程数与共享的每秒请求预算 (OAuth 客户端上限约 100 次/分钟)
+REDDIT_MAX_WORKERS = int(os.getenv("REDDIT_MAX_WORKERS", "8"))
+REDDIT_REQUESTS_PER_SECOND = float(os.getenv("REDDIT_REQUESTS_PER_SECOND", "1.5"))
+REDDIT_BURST = int(os.getenv("REDDIT_BURST", "10"))
+REDDIT_PAGE_SIZE = 100  # Reddit 列表接口每页最多返回 100 条
+# 评论树抓取上限：每个帖子最多额外展开几批 "more children" (每批最多 100 条)、最大楼层深度、最多保留的评论数
+COMMENT_MORE_BATCHES = int(os.getenv("COMMENT_MORE_BATCHES", "0"))
+COMMENT_MAX_DEPTH = int(os.getenv("COMMENT_MAX_DEPTH", "8"))
+COMMENT_MAX_PER_SUBMISSION = int(os.getenv("COMMENT_MAX_PER_SUBMISSION", "500"))
+MORE_CHILDREN_BATCH_SIZE = 100
+# 本地持久化缓存：搜索结果与评论树的过期时间 (秒) 以及缓存文件大小上限
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "reddit_cache.sqlite3")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600)))
+COMMENT_CACHE_TTL = int(os.getenv("COMMENT_CACHE_TTL", str(12 * 3600)))
+# 增量分析状态 (水位线、已跟踪帖子及其评论水位线、上次的分析结果) 的保存时间，以及最多跟踪的帖子数
+INCREMENTAL_STATE_TTL = int(os.getenv("INCREMENTAL_STATE_TTL", str(90 * 24 * 3600)))
+INCREMENTAL_SEEN_LIMIT = 5000
+# 增量模式下每个版块最多向前翻多少个新帖子 (Reddit 列表接口最多只能翻到约 1000 条)，以及最多保留多少个未入选的新帖子留待下次分析
+INCREMENTAL_MAX_NEW_POSTS = 1000
+INCREMENTAL_PENDING_LIMIT = 500
+# 已跟踪帖子的新评论刷新范围：只刷新发帖时间在最近 N 天内的帖子，且每次最多刷新多少个 (同时不超过本次任务的帖子数 limit)
+INCREMENTAL_REFRESH_DAYS = int(os.getenv("INCREMENTAL_REFRESH_DAYS", "7"))
+INCREMENTAL_REFRESH_THREADS = int(os.getenv("INCREMENTAL_REFRESH_THREADS", "50"))
+# AI 推荐版块的缓存：关键词 -> 版块列表 (内存 LRU + 磁盘)，版块名 -> 中文译名 (长期有效)
+AI_SUBREDDITS_CACHE_TTL = int(os.getenv("AI_SUBREDDITS_CACHE_TTL", str(7 * 24 * 3600)))
+AI_SUBREDDITS_MEMORY_SIZE = int(os.getenv("AI_SUBREDDITS_MEMORY_SIZE", "256"))
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(180 * 24 * 3600)))
 
 
-# --- 线程锁，确保文件访问安全 ---
-file_lock = threading.Lock()
+# --- 令牌桶限流器：所有抓取线程共享同一份 Reddit 请求预算 ---
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
 
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    print("--- Gemini API 配置成功 ---")
-except Exception as e:
-    print(f"!!! Gemini API 配置失败: {e} !!!")
-    exit(1)
-
-# --- 状态更新帮助函数 (带锁) ---
-def update_status_file(status_text, progress_percent, report_url=None, ai_subreddits=None):
-    with file_lock:
-        current_state = {}
-        if os.path.exists(STATUS_FILE):
+    def acquire(self, tokens=1):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_seconds = (tokens - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+reddit_rate_limiter = TokenBucket(REDDIT_REQUESTS_PER_SECOND, REDDIT_BURST)
+
+# --- 本地磁盘缓存 (SQLite)：按过期时间和总大小淘汰，记录每个命名空间的命中/未命中次数 ---
+class DiskCache:
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.conn = None
+        try:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS cache_entries (namespace TEXT, key TEXT, value TEXT, size INTEGER, expires_at REAL, accessed_at REAL, PRIMARY KEY (namespace, key))")
+            # 需要长期保留的状态 (如增量分析的水位线) 单独建表，只按过期时间清理，不参与按大小的 LRU 淘汰
+            self.conn.execute("CREATE TABLE IF NOT EXISTS state_entries (namespace TEXT, key TEXT, value TEXT, expires_at REAL, PRIMARY KEY (namespace, key))")
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"!!! [缓存] 无法打开缓存文件 {path}: {e}。本次运行将不使用缓存。 !!!")
+            self.conn = None
+
+    def _count(self, namespace, outcome):
+        counter = self.counters.setdefault(namespace, {"hits": 0, "misses": 0})
+        counter[outcome] += 1
+
+    def get(self, namespace, key):
+        cache_key = json.dumps(key, ensure_ascii=False)
+        with self.lock:
+            row = None
+            if self.conn is not None:
+                try:
+                    now = time.time()
+                    row = self.conn.execute("SELECT value FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?", (namespace, cache_key, now)).fetchone()
+                    if row is not None:
+                        self.conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, cache_key))
+                        self.conn.commit()
+                except sqlite3.Error as e:
+                    print(f"!!! [缓存] 读取失败: {e} !!!")
+                    row = None
+            self._count(namespace, "hits" if row is not None else "misses")
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, namespace, key, value, ttl):
+        cache_key = json.dumps(key, ensure_ascii=False)
+        payload = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            if self.conn is None:
+                return
+            try:
+                now = time.time()
+                self.conn.execute("INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?)", (namespace, cache_key, payload, len(payload), now + ttl, now))
+                self._evict(now)
+                self.conn.commit()
+            except sqlite3.Error as e:
+                print(f"!!! [缓存] 写入失败: {e} !!!")
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+        total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        # 超出大小上限时，按最近访问时间从旧到新淘汰
+        for namespace, key, size in self.conn.execute("SELECT namespace, key, size FROM cache_entries ORDER BY accessed_at").fetchall():
+            if total_size <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+            total_size -= size
+
+    def get_state(self, namespace, key):
+        state_key = json.dumps(key, ensure_ascii=False)
+        with self.lock:
+            if self.conn is None:
+                return None
+            try:
+                row = self.conn.execute("SELECT value FROM state_entries WHERE namespace = ? AND key = ? AND expires_at > ?", (namespace, state_key, time.time())).fetchone()
+            except sqlite3.Error as e:
+                print(f"!!! [缓存] 读取状态失败: {e} !!!")
+                row = None
+        return json.loads(row[0]) if row is not None else None
+
+    def set_state(self, namespace, key, value, ttl):
+        state_key = json.dumps(key, ensure_ascii=False)
+        payload = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            if self.conn is None:
+                return
             try:
-                with open(STATUS_FILE, 'r', encoding='utf-8') as f:
-                    current_state = json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                current_state = {}
+                now = time.time()
+                self.conn.execute("DELETE FROM state_entries WHERE expires_at <= ?", (now,))
+                self.conn.execute("INSERT OR REPLACE INTO state_entries VALUES (?, ?, ?, ?)", (namespace, state_key, payload, now + ttl))
+                self.conn.commit()
+            except sqlite3.Error as e:
+                print(f"!!! [缓存] 写入状态失败: {e} !!!")
+
+    def get_stats(self):
+        with self.lock:
+            return {namespace: dict(counter) for namespace, counter in self.counters.items()}
+
+response_cache = DiskCache(CACHE_DB_PATH, CACHE_MAX_BYTES)
+
+# --- 任务指标：每个任务记录各阶段耗时与计数，结束后汇总进全局直方图，供 /metrics 导出 ---
+# stage 只用于主线程上顺序执行的阶段 (墙钟时间)；可能在多个线程中并发发生的单次调用用 call 记录每次的耗时，
+# 它们的总和是 "调用秒数"，可能超过任务总耗时，因此单独导出，不混入阶段耗时
+STAGE_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+JOB_VALUE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+class JobMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.calls = {}
+        self.counters = {}
+
+    @contextmanager
+    def call(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.calls.setdefault(name, []).append(time.perf_counter() - started_at)
+
+    @contextmanager
+    def stage(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started_at)
+
+    def record_stage(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {"stage_seconds": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+                    "call_seconds": {name: [round(seconds, 4) for seconds in latencies] for name, latencies in self.calls.items()},
+                    "counters": dict(self.counters)}
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[i] += 1
 
-        current_state["status"] = status_text
-        current_state["progress"] = progress_percent
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_seconds = {}
+        self.call_seconds = {}
+        self.job_values = {}
+        self.counter_totals = {}
+        self.jobs_by_state = {}
+        self.startup_seconds = None
+        self.client_init_seconds = {}
+
+    def record_client_init(self, name, seconds):
+        with self.lock:
+            self.client_init_seconds[name] = seconds
+
+    def record_job(self, snapshot, state):
+        with self.lock:
+            self.jobs_by_state[state] = self.jobs_by_state.get(state, 0) + 1
+            for name, seconds in snapshot["stage_seconds"].items():
+                self.stage_seconds.setdefault(name, Histogram(STAGE_SECONDS_BUCKETS)).observe(seconds)
+            for name, latencies in snapshot.get("call_seconds", {}).items():
+                for seconds in latencies:
+                    self.call_seconds.setdefault(name, Histogram(STAGE_SECONDS_BUCKETS)).observe(seconds)
+            for name, value in snapshot["counters"].items():
+                self.job_values.setdefault(name, Histogram(JOB_VALUE_BUCKETS)).observe(value)
+                self.counter_totals[name] = self.counter_totals.get(name, 0) + value
+
+    def render_prometheus(self):
+        lines = []
+
+        def render_histograms(metric, help_text, label, histograms):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in sorted(histograms.items()):
+                for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{upper_bound}"}} {bucket_count}')
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram.total}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {histogram.count}')
+
+        with self.lock:
+            render_histograms("reddit_analyzer_stage_seconds", "Wall time spent in each task stage.", "stage", self.stage_seconds)
+            render_histograms("reddit_analyzer_call_seconds", "Latency of individual calls that may run concurrently; the sum is call-seconds, not wall time.", "call", self.call_seconds)
+            render_histograms("reddit_analyzer_job_value", "Per-job totals such as API calls, items fetched and prompt sizes.", "name", self.job_values)
+            lines.append("# HELP reddit_analyzer_events_total Totals of per-job counters across finished jobs.")
+            lines.append("# TYPE reddit_analyzer_events_total counter")
+            for name, value in sorted(self.counter_totals.items()):
+                lines.append(f'reddit_analyzer_events_total{{name="{name}"}} {value}')
+            lines.append("# HELP reddit_analyzer_jobs_total Finished jobs by final state.")
+            lines.append("# TYPE reddit_analyzer_jobs_total counter")
+            for state, value in sorted(self.jobs_by_state.items()):
+                lines.append(f'reddit_analyzer_jobs_total{{state="{state}"}} {value}')
+            if self.startup_seconds is not None:
+                lines.append("# HELP reddit_analyzer_startup_seconds Time from process import to ready to serve.")
+                lines.append("# TYPE reddit_analyzer_startup_seconds gauge")
+                lines.append(f"reddit_analyzer_startup_seconds {self.startup_seconds}")
+                lines.append("# HELP reddit_analyzer_startup_budget_seconds Configured cold start budget (STARTUP_BUDGET_MS).")
+                lines.append("# TYPE reddit_analyzer_startup_budget_seconds gauge")
+                lines.append(f"reddit_analyzer_startup_budget_seconds {STARTUP_BUDGET_MS / 1000}")
+            lines.append("# HELP reddit_analyzer_client_init_seconds Time spent importing and building each lazily created client.")
+            lines.append("# TYPE reddit_analyzer_client_init_seconds gauge")
+            for name, seconds in sorted(self.client_init_seconds.items()):
+                lines.append(f'reddit_analyzer_client_init_seconds{{client="{name}"}} {seconds}')
+        lines.append("# HELP reddit_analyzer_cache_requests_total Disk cache lookups by namespace and outcome.")
+        lines.append("# TYPE reddit_analyzer_cache_requests_total counter")
+        for namespace, counter in sorted(response_cache.get_stats().items()):
+            for outcome, value in sorted(counter.items()):
+                lines.append(f'reddit_analyzer_cache_requests_total{{namespace="{namespace}",outcome="{outcome}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+metrics_registry = MetricsRegistry()
+
+# --- 共享客户端：进程内所有任务复用同一个 Reddit 客户端和同一个 Gemini 模型对象，第一次使用时才导入并创建 ---
+# Reddit 客户端只做一次 OAuth 令牌交换 (过期后由 praw 自动刷新)，并通过带连接池的 Session 复用 keep-alive 连接
+shared_clients_lock = threading.Lock()
+shared_clients = {}
+
+def build_reddit_client():
+    import praw
+    import requests
+    session = requests.Session()
+    # 每个并发任务最多有 REDDIT_MAX_WORKERS 个线程同时发请求，连接池按此放大，避免连接被反复关闭重建
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=REDDIT_MAX_WORKERS * MAX_CONCURRENT_JOBS)
+    session.mount("https://", adapter)
+    return praw.Reddit(client_id=REDDIT_CLIENT_ID, client_secret=REDDIT_CLIENT_SECRET, user_agent=REDDIT_USER_AGENT, username=REDDIT_USERNAME, password=REDDIT_PASSWORD,
+                       requestor_kwargs={"session": session})
+
+def build_gemini_model():
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+def get_shared_client(name, builder):
+    with shared_clients_lock:
+        if name not in shared_clients:
+            started_at = time.perf_counter()
+            shared_clients[name] = builder()
+            init_seconds = time.perf_counter() - started_at
+            metrics_registry.record_client_init(name, round(init_seconds, 4))
+            print(f"--- [客户端] {name} 初始化完成，耗时 {init_seconds:.3f}s ---")
+        return shared_clients[name]
+
+def get_reddit_client():
+    return get_shared_client("reddit", build_reddit_client)
+
+def get_gemini_model():
+    return get_shared_client("gemini", build_gemini_model)
+
+# --- Gemini 调用封装：统计调用次数与请求/响应大小，并限制全局并发请求数 ---
+gemini_call_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENT_CALLS)
+
+def call_gemini(model, prompt, metrics):
+    metrics.add("gemini_calls")
+    metrics.add("prompt_chars", len(prompt))
+    with gemini_call_slots, metrics.call("gemini"):
+        response = model.generate_content(prompt)
+    metrics.add("response_chars", len(response.text))
+    return response
+
+# --- AI 推荐版块的内存缓存层 (磁盘层复用 response_cache) ---
+ai_cache_lock = threading.Lock()
+ai_subreddits_memory = TTLCache(maxsize=AI_SUBREDDITS_MEMORY_SIZE, ttl=AI_SUBREDDITS_CACHE_TTL)
+subreddit_translations = {}
+
+# --- 任务注册表：内存中保存所有任务状态，只在任务状态切换时写快照文件 ---
+jobs_lock = threading.Lock()
+persist_lock = threading.Lock()
+jobs = {}
+# 每次状态变化都会递增版本号并唤醒等待中的推送连接
+job_versions = {}
+jobs_changed = threading.Condition(jobs_lock)
+sse_lock = threading.Lock()
+active_sse_streams = 0
+job_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="task-job")
+
+def persist_jobs():
+    if not JOB_PERSIST:
+        return
+    # 在 persist_lock 内取快照，保证按取快照的顺序写文件，较旧的快照不会覆盖较新的 (加锁顺序: persist_lock -> jobs_lock)
+    with persist_lock:
+        with jobs_lock:
+            snapshot = {job_id: dict(job) for job_id, job in jobs.items()}
+        try:
+            tmp_path = JOBS_FILE + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, JOBS_FILE)
+        except OSError as e:
+            print(f"!!! [任务调度] 保存任务快照失败: {e} !!!")
+
+def load_jobs():
+    if not JOB_PERSIST or not os.path.exists(JOBS_FILE):
+        return
+    try:
+        with open(JOBS_FILE, 'r', encoding='utf-8') as f:
+            saved_jobs = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"!!! [任务调度] 读取任务快照失败: {e} !!!")
+        return
+    for job in saved_jobs.values():
+        # 重启前尚未结束的任务已经随进程一起中断
+        if job.get("state") in ("queued", "running"):
+            job.update({"state": "failed", "status": "服务已重启，任务被中断", "progress": 100})
+    with jobs_lock:
+        jobs.update(saved_jobs)
+    print(f"--- [任务调度] 已从快照恢复 {len(saved_jobs)} 个任务 ---")
+
+def trim_job_history():
+    finished_ids = [job_id for job_id, job in jobs.items() if job["state"] in ("done", "failed")]
+    for job_id in finished_ids[:max(0, len(jobs) - JOB_HISTORY_LIMIT)]:
+        del jobs[job_id]
+        job_versions.pop(job_id, None)
+
+# 队列已满时返回 None，由调用方拒绝新任务
+def create_job():
+    with jobs_lock:
+        active_jobs = sum(1 for job in jobs.values() if job["state"] in ("queued", "running"))
+        if active_jobs >= MAX_CONCURRENT_JOBS + MAX_QUEUED_JOBS:
+            return None
+        job_id = uuid.uuid4().hex[:12]
+        jobs[job_id] = {"job_id": job_id, "state": "queued", "status": "任务排队中...", "progress": 0, "report_url": "", "ai_subreddits": None, "created_at": time.time()}
+        trim_job_history()
+    persist_jobs()
+    return job_id
+
+def get_job_status(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+def update_job_status(job_id, status_text, progress_percent, report_url=None, ai_subreddits=None, state=None, metrics=None):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return
+        previous_state = job["state"]
+        job["status"] = status_text
+        job["progress"] = progress_percent
         if report_url is not None:
-            current_state["report_url"] = report_url
+            job["report_url"] = report_url
         if ai_subreddits is not None:
-            current_state["ai_subreddits"] = ai_subreddits
-            
-        with open(STATUS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(current_state, f, ensure_ascii=False, indent=4)
-    print(f"--- [状态更新] {status_text} ({progress_percent}%) ---")
+            job["ai_subreddits"] = ai_subreddits
+        if metrics is not None:
+            job["metrics"] = metrics
+        if state is None and progress_percent >= 100:
+            state = "done" if job["report_url"] else "failed"
+        if state is not None:
+            job["state"] = state
+        state_changed = job["state"] != previous_state
+        job_versions[job_id] = job_versions.get(job_id, 0) + 1
+        jobs_changed.notify_all()
+    if state_changed:
+        persist_jobs()
+    print(f"--- [状态更新] [{job_id}] {status_text} ({progress_percent}%) ---")
+
+def run_job(job_id, *task_args):
+    update_job_status(job_id, "任务初始化...", 0, state="running")
+    real_task_runner(job_id, *task_args)
 
 # --- 智能检索版块函数 ---
-def get_ai_subreddits(keyword):
+def lookup_ai_subreddits(cache_key):
+    with ai_cache_lock:
+        subreddit_list = ai_subreddits_memory.get(cache_key)
+    if subreddit_list is None:
+        subreddit_list = response_cache.get("ai_subreddits", cache_key)
+        if subreddit_list is not None:
+            with ai_cache_lock:
+                ai_subreddits_memory[cache_key] = subreddit_list
+    return subreddit_list
+
+def remember_ai_subreddits(cache_key, subreddit_list):
+    with ai_cache_lock:
+        ai_subreddits_memory[cache_key] = subreddit_list
+    response_cache.set("ai_subreddits", cache_key, subreddit_list, AI_SUBREDDITS_CACHE_TTL)
+
+def lookup_translation(sub_name):
+    with ai_cache_lock:
+        translation = subreddit_translations.get(sub_name.lower())
+    if translation is None:
+        translation = response_cache.get("subreddit_translation", sub_name.lower())
+        if translation is not None:
+            with ai_cache_lock:
+                subreddit_translations[sub_name.lower()] = translation
+    return translation
+
+def remember_translations(translations):
+    for sub_name, translation in translations.items():
+        if not isinstance(translation, str) or not translation:
+            continue
+        with ai_cache_lock:
+            subreddit_translations[sub_name.lower()] = translation
+        response_cache.set("subreddit_translation", sub_name.lower(), translation, TRANSLATION_CACHE_TTL)
+
+def get_ai_subreddits(job_id, keyword, metrics):
+    with metrics.stage("ai_subreddits"):
+        return fetch_ai_subreddits(job_id, keyword, metrics)
+
+def fetch_ai_subreddits(job_id, keyword, metrics):
     try:
-        update_status_file("正在请求 AI 推荐相关版块...", 10)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        prompt_for_subreddits = f'针对关键词 "{keyword}"，请推荐最多15个最相关的 Reddit 子版块。返回格式必须是单一字符串，由+连接。'
-        response = model.generate_content(prompt_for_subreddits)
-        ai_generated_string = response.text.strip().replace("\n", "")
-        
-        if not re.match(r'^[a-zA-Z0-9_/]+(\+[a-zA-Z0-9_/]+)*$', ai_generated_string):
-            raise ValueError(f"获取的版块格式不符合预期: '{ai_generated_string}'")
+        update_job_status(job_id, "正在请求 AI 推荐相关版块...", 10)
+        cache_key = keyword.strip().lower()
+        subreddit_list = lookup_ai_subreddits(cache_key)
+        model_called = False
 
-        subreddit_list = [sub.replace('r/', '') for sub in ai_generated_string.split('+') if sub]
-        
-        update_status_file("获取版块成功，正在请求 AI 翻译...", 12)
-        prompt_for_translation = f'请将以下Reddit版块名翻译成中文，并返回一个完整的JSON对象，键是英文名，值是中文名：{", ".join(subreddit_list)}'
-        response_translation = model.generate_content(prompt_for_translation)
-        match = re.search(r'\{.*\}', response_translation.text, re.DOTALL)
-        if not match: raise ValueError("翻译API未能返回有效的JSON格式。")
-        
-        translations = json.loads(match.group(0))
-        results_for_frontend = [{"name": sub, "translation": translations.get(sub, "翻译失败")} for sub in subreddit_list]
-        
-        update_status_file("AI推荐版块已生成", 15, ai_subreddits=results_for_frontend)
-        return ai_generated_string
+        if subreddit_list is None:
+            # 一次调用同时拿到版块列表和中文译名
+            model = get_gemini_model()
+            prompt_for_subreddits = f'针对关键词 "{keyword}"，请推荐最多15个最相关的 Reddit 子版块，并把每个版块名翻译成中文。只返回一个JSON对象，格式为：{{"subreddits": ["版块英文名"], "translations": {{"版块英文名": "中文名"}}}}'
+            response = call_gemini(model, prompt_for_subreddits, metrics)
+            model_called = True
+            match = re.search(r'\{.*\}', response.text, re.DOTALL)
+            if not match: raise ValueError("推荐版块API未能返回有效的JSON格式。")
+
+            ai_result = json.loads(match.group(0))
+            subreddit_list = [str(sub).strip().replace('r/', '') for sub in ai_result.get("subreddits", []) if str(sub).strip()]
+            invalid_names = [sub for sub in subreddit_list if not re.match(r'^[a-zA-Z0-9_]+$', sub)]
+            if not subreddit_list or invalid_names:
+                raise ValueError(f"获取的版块格式不符合预期: {ai_result.get('subreddits')}")
+
+            remember_ai_subreddits(cache_key, subreddit_list)
+            translations = ai_result.get("translations", {})
+            if isinstance(translations, dict):
+                remember_translations(translations)
+        else:
+            print(f"--- [缓存] 命中关键词 '{keyword}' 的 AI 推荐版块 ({len(subreddit_list)} 个)")
+
+        # 翻译只影响展示：补译失败时保留已拿到的版块列表，缺失的译名显示为"翻译失败"
+        missing_translations = [sub for sub in subreddit_list if lookup_translation(sub) is None]
+        if missing_translations and not model_called:
+            try:
+                update_job_status(job_id, "获取版块成功，正在请求 AI 翻译...", 12)
+                model = get_gemini_model()
+                prompt_for_translation = f'请将以下Reddit版块名翻译成中文，并返回一个完整的JSON对象，键是英文名，值是中文名：{", ".join(missing_translations)}'
+                response_translation = call_gemini(model, prompt_for_translation, metrics)
+                match = re.search(r'\{.*\}', response_translation.text, re.DOTALL)
+                if not match: raise ValueError("翻译API未能返回有效的JSON格式。")
+                remember_translations(json.loads(match.group(0)))
+            except Exception as e:
+                print(f"!!! [智能检索] 版块翻译失败: {e}。继续使用已获取的 {len(subreddit_list)} 个版块。 !!!")
+
+        results_for_frontend = [{"name": sub, "translation": lookup_translation(sub) or "翻译失败"} for sub in subreddit_list]
+
+        update_job_status(job_id, "AI推荐版块已生成", 15, ai_subreddits=results_for_frontend)
+        return "+".join(subreddit_list)
     except Exception as e:
         print(f"!!! [智能检索] 过程中发生错误: {e}。将使用默认版块列表。 !!!")
-        update_status_file(f"智能检索失败: {e}", 15)
+        update_job_status(job_id, f"智能检索失败: {e}", 15)
         return SUBREDDITS_TO_SEARCH
 
 # --- 报告生成函数 (V1.9 - 视觉增强版) ---
@@ -208,122 +694,677 @@ def generate_report_html(report_data_json, keyword, used_subreddits, analysis_mo
         empty_json = json.dumps({})
         return f"<h1>报告生成失败</h1><p>解析AI返回的数据时出错: {e}</p><pre>{str(empty_json)}</pre>"
 
-# --- 核心任务执行函数 (双引擎 + 幽灵数据修复版) ---
-def real_task_runner(keyword, timeframe, sort_order, limit, search_mode, blocked_keywords, analysis_mode):
-    print(f"--- [演员上台] Keyword: {keyword}, Mode: {analysis_mode} ---")
+# --- 单个版块搜索：逐条产出帖子，收到停止信号后不再请求下一页 ---
+def build_search_query(keyword, sort_order, analysis_mode):
+    if analysis_mode == 'pain_points':
+        pain_point_keywords = [f'{keyword} {p}' for p in ['problem', 'issue', 'recommendation', 'help', 'question', 'advice', 'frustrated', 'annoying', 'wish', 'sucks', 'broken', 'how to', 'alternative', 'fix', 'solution', 'nightmare', 'disappointed']]
+        return f'({" OR ".join(pain_point_keywords)})', 'relevance'
+    return f'"{keyword}"', sort_order
+
+# 提前终止时也缓存已抓到的前缀并标记是否完整；再次运行时先回放前缀，仍需要更多结果时从前缀末尾接着翻页
+def iter_subreddit_search(reddit, sub_name, search_query, final_sort_order, timeframe, quota, stop_event, metrics, analysis_mode, use_cache=True):
+    if analysis_mode == 'pain_points':
+        print(f"--- [PRAW] ==> 正在版块 r/{sub_name} 中以“痛点挖掘”模式搜索...")
+    else:
+        print(f"--- [PRAW] ==> 正在版块 r/{sub_name} 中以“热点分析”模式搜索...")
+
+    search_params = {'query': search_query, 'sort': final_sort_order}
+    if final_sort_order in ['top', 'relevance']:
+        search_params['time_filter'] = timeframe
+    cache_key = [sub_name, search_query, final_sort_order, search_params.get('time_filter'), quota]
+    cached = response_cache.get("search", cache_key) if use_cache else None
+    if isinstance(cached, list):
+        cached = {"results": cached, "complete": True}  # 旧格式的缓存只保存完整结果
+    results = []
+    if cached is not None:
+        print(f"--- [缓存] 命中 r/{sub_name} 的搜索结果 ({len(cached['results'])} 个帖子，{'完整' if cached['complete'] else '部分'})")
+        for result in cached["results"]:
+            if stop_event.is_set():
+                return
+            results.append(result)
+            yield result
+        if cached["complete"] or stop_event.is_set():
+            return
+    cached_count = len(results)
+    if cached_count >= quota:
+        return
+
+    listing = reddit.subreddit(sub_name).search(**search_params, limit=quota - cached_count, params={"after": f"t3_{results[-1]['id']}"} if results else None)
+    complete = False
     try:
-        subreddits_for_this_task = ""
-        if search_mode == "smart":
-            subreddits_for_this_task = get_ai_subreddits(keyword)
-        elif search_mode == "standard":
-            subreddits_for_this_task = SUBREDDITS_TO_SEARCH
-        
-        update_status_file("正在连接 Reddit...", 20)
-        reddit = praw.Reddit(client_id=REDDIT_CLIENT_ID, client_secret=REDDIT_CLIENT_SECRET, user_agent=REDDIT_USER_AGENT, username=REDDIT_USERNAME, password=REDDIT_PASSWORD)
-        
-        individual_subreddits = ['all'] if search_mode == 'all_reddit' else [s.replace('r/', '') for s in subreddits_for_this_task.split('+') if s]
-        if not individual_subreddits: raise ValueError("未能确定任何要搜索的版块。")
+        while not stop_event.is_set():
+            # 每一页结果都是一次 Reddit 请求，翻页前从共享令牌桶中扣减预算
+            if (len(results) - cached_count) % REDDIT_PAGE_SIZE == 0:
+                reddit_rate_limiter.acquire()
+                metrics.add("reddit_api_calls")
+            submission = next(listing, None)
+            if submission is None:
+                complete = True
+                return
+            result = {"id": submission.id, "title": submission.title, "selftext": submission.selftext, "score": submission.score, "created_utc": submission.created_utc}
+            results.append(result)
+            yield result
+    finally:
+        # 消费方提前停止时生成器在 yield 处被关闭，因此在 finally 中写缓存
+        if use_cache and (complete or len(results) > cached_count):
+            response_cache.set("search", cache_key, {"results": results, "complete": complete}, SEARCH_CACHE_TTL)
 
-        update_status_file(f"在 {len(individual_subreddits)} 个版块中搜索...", 25)
-        
-        target_fetch_count = int(limit) * 3
-        quota_per_sub = (target_fetch_count // len(individual_subreddits)) if len(individual_subreddits) > 0 else target_fetch_count
-        all_search_results = []
-        
+# --- 抓取流水线：搜索结果流经屏蔽词过滤进入有界 Top-K，确定入选的帖子立即开始抓评论 ---
+# 增量模式下传入水位线 since：按时间倒序搜索，遇到不晚于水位线的帖子即停止该版块；
+# 上次未入选的新帖子 (pending) 与本次的新帖子一起竞争 Top-K，本次仍未入选的放进 stats["pending"] 由调用方保存
+def run_fetch_pipeline(job_id, reddit, individual_subreddits, keyword, timeframe, sort_order, limit, analysis_mode, blocklist, metrics, since=None, seen_ids=frozenset(), pending=()):
+    search_query, final_sort_order = build_search_query(keyword, sort_order, analysis_mode)
+    quota = max(1, (limit * 3) // len(individual_subreddits))
+    if since is not None:
+        # 增量模式要看到水位线之后的全部新帖子，否则配额之外的新帖子会被下一次的水位线跳过
+        final_sort_order = 'new'
+        quota = INCREMENTAL_MAX_NEW_POSTS
+    # 只有按 top 排序时，每个版块的结果才按分数单调递减，才能据此提前终止和提前确认
+    score_ordered = final_sort_order == 'top'
+    stop_events = {sub_name: threading.Event() for sub_name in individual_subreddits}
+    result_queue = queue.Queue(maxsize=REDDIT_PAGE_SIZE * 2)
+    stats = {"fetched": 0, "blocked": 0, "stopped_early": 0, "already_seen": 0, "watermark": since, "comment_watermarks": {}, "pending": []}
+    # 水位线取本次抓取开始的时间：开始之前发布的帖子要么本次已经看到，要么 (版块出错时) 由下面的记录把水位线压回去
+    fetch_started_utc = time.time()
+    delta_created, candidates, oldest_by_subreddit, failed_subreddits = [], {}, {}, set()
+
+    def produce(sub_name):
+        try:
+            # 增量模式依赖最新的帖子列表，不使用搜索缓存
+            for result in iter_subreddit_search(reddit, sub_name, search_query, final_sort_order, timeframe, quota, stop_events[sub_name], metrics, analysis_mode, use_cache=since is None):
+                if stop_events[sub_name].is_set():
+                    break
+                result_queue.put((sub_name, result))
+                if since is not None and result["created_utc"] <= since:
+                    break  # 按时间倒序排列，之后的帖子都不晚于水位线，不必再翻页
+        except Exception as e:
+            failed_subreddits.add(sub_name)
+            print(f"!!! [PRAW] 警告：搜索 r/{sub_name} 时出错: {e}。已跳过。!!!")
+        finally:
+            result_queue.put((sub_name, None))
+
+    top_k = []  # 小顶堆: (score, 序号, 帖子)
+    last_scores = {}
+    comment_futures = {}
+    sequence = 0
+    active_subreddits = set(individual_subreddits)
+    for result in pending:
+        if blocklist.matches(result["title"], result.get("selftext")):
+            stats["blocked"] += 1
+            continue
+        candidates[result["id"]] = result
+        heapq.heappush(top_k, (result["score"], sequence, result))
+        if len(top_k) > limit:
+            heapq.heappop(top_k)
+        sequence += 1
+    search_started_at = time.perf_counter()
+    search_workers = max(1, min(REDDIT_MAX_WORKERS, len(individual_subreddits)))
+    with ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="reddit-search") as search_executor, \
+         ThreadPoolExecutor(max_workers=REDDIT_MAX_WORKERS, thread_name_prefix="reddit-comments") as comment_executor:
         for sub_name in individual_subreddits:
-            try:
-                search_query = ""
-                final_sort_order = sort_order
-                
-                if analysis_mode == 'pain_points':
-                    print(f"--- [PRAW] ==> 正在版块 r/{sub_name} 中以“痛点挖掘”模式搜索...")
-                    pain_point_keywords = [f'{keyword} {p}' for p in ['problem', 'issue', 'recommendation', 'help', 'question', 'advice', 'frustrated', 'annoying', 'wish', 'sucks', 'broken', 'how to', 'alternative', 'fix', 'solution', 'nightmare', 'disappointed']]
-                    search_query = f'({" OR ".join(pain_point_keywords)})'
-                    final_sort_order = 'relevance'
-                else:
-                    print(f"--- [PRAW] ==> 正在版块 r/{sub_name} 中以“热点分析”模式搜索...")
-                    search_query = f'"{keyword}"'
-                
-                subreddit = reddit.subreddit(sub_name)
-                search_params = {'query': search_query, 'limit': quota_per_sub, 'sort': final_sort_order}
-                if final_sort_order in ['top', 'relevance']:
-                    search_params['time_filter'] = timeframe
-                all_search_results.extend(list(subreddit.search(**search_params)))
-            except Exception as e:
-                print(f"!!! [PRAW] 警告：搜索 r/{sub_name} 时出错: {e}。已跳过。!!!")
+            search_executor.submit(produce, sub_name)
 
-        print(f"--- [PRAW] 抓取完成，共获得 {len(all_search_results)} 个帖子。")
-        if not all_search_results: raise ValueError(f"未能找到关于 '{keyword}' 的任何帖子。请尝试“市场热点分析”模式或更换关键词。")
+        try:
+            while active_subreddits:
+                sub_name, result = result_queue.get()
+                if result is None:
+                    active_subreddits.discard(sub_name)
+                    last_scores.pop(sub_name, None)
+                else:
+                    stats["fetched"] += 1
+                    last_scores[sub_name] = result["score"]
+                    if since is not None and result["created_utc"] > since:
+                        delta_created.append(result["created_utc"])
+                        oldest_by_subreddit[sub_name] = min(oldest_by_subreddit.get(sub_name, result["created_utc"]), result["created_utc"])
+                    if since is not None and result["created_utc"] <= since:
+                        stats["already_seen"] += 1
+                        if not stop_events[sub_name].is_set():
+                            stop_events[sub_name].set()
+                            stats["stopped_early"] += 1
+                    elif result["id"] in seen_ids:
+                        stats["already_seen"] += 1
+                    elif blocklist.matches(result["title"], result.get("selftext")):
+                        stats["blocked"] += 1
+                    else:
+                        candidates[result["id"]] = result
+                        if len(top_k) < limit:
+                            heapq.heappush(top_k, (result["score"], sequence, result))
+                        elif result["score"] > top_k[0][0]:
+                            heapq.heapreplace(top_k, (result["score"], sequence, result))
+                        elif score_ordered and not stop_events[sub_name].is_set():
+                            # 该版块后续结果的分数只会更低，不可能再进入 Top-K
+                            stop_events[sub_name].set()
+                            stats["stopped_early"] += 1
+                    sequence += 1
 
-        update_status_file("帖子抓取完毕，正在排序和过滤...", 40)
-        all_search_results.sort(key=lambda x: x.score, reverse=True)
-        
-        final_submissions = []
-        for s in all_search_results:
-            if len(final_submissions) >= int(limit): break
-            if not any(bw in s.title.lower() for bw in blocked_keywords):
-                final_submissions.append(s)
+                if score_ordered:
+                    # 尚未返回任何结果的版块上界视为无穷大；分数不低于所有上界的帖子已不可能被挤出
+                    upper_bound = max((last_scores.get(s, float('inf')) for s in active_subreddits), default=float('-inf'))
+                    for score, _, submission in top_k:
+                        if score >= upper_bound and submission["id"] not in comment_futures:
+                            comment_futures[submission["id"]] = comment_executor.submit(load_comments_cached, reddit, submission["id"], metrics)
+        finally:
+            if active_subreddits:
+                # 消费者异常退出时先叫停所有生产者并取空队列，否则阻塞在 put 上的生产者会让 executor 退出时的 shutdown(wait=True) 一直等下去
+                for stop_event in stop_events.values():
+                    stop_event.set()
+                for future in comment_futures.values():
+                    future.cancel()
+                while active_subreddits:
+                    sub_name, result = result_queue.get()
+                    if result is None:
+                        active_subreddits.discard(sub_name)
 
-        print(f"--- [主任务] 筛选完成，最终选定 {len(final_submissions)} 个帖子进行分析。")
-        if not final_submissions: raise ValueError(f"过滤屏蔽词后，未能找到有效的帖子。")
+        final_submissions = [submission for _, _, submission in sorted(top_k, key=lambda entry: (-entry[0], entry[1]))]
+        if since is None:
+            stats["watermark"] = fetch_started_utc
+        else:
+            # 出错版块里没抓到的帖子必须留在新水位线之后；未入选的新帖子不再压住水位线，而是作为 pending 保存。
+            # 因 INCREMENTAL_MAX_NEW_POSTS 截断的版块视为已抓全 (Reddit 本身也翻不到更早的帖子)
+            if failed_subreddits:
+                cutoff = min(oldest_by_subreddit.get(sub_name, since) for sub_name in failed_subreddits)
+                stats["watermark"] = max([since] + [created for created in delta_created if created < cutoff])
+            else:
+                stats["watermark"] = fetch_started_utc
+            selected_ids = {submission["id"] for submission in final_submissions}
+            leftovers = [result for submission_id, result in candidates.items() if submission_id not in selected_ids]
+            stats["pending"] = sorted(leftovers, key=lambda result: result["score"], reverse=True)[:INCREMENTAL_PENDING_LIMIT]
+        metrics.record_stage("reddit_search", time.perf_counter() - search_started_at)
+        metrics.add("posts_fetched", stats["fetched"])
+        metrics.add("posts_blocked", stats["blocked"])
+        metrics.add("posts_selected", len(final_submissions))
+        print(f"--- [PRAW] 抓取完成，共获得 {stats['fetched']} 个帖子，屏蔽 {stats['blocked']} 个，提前终止 {stats['stopped_early']} 个版块的搜索。")
+        if not final_submissions:
+            return [], [], stats
 
-        update_status_file(f"正在从 {len(final_submissions)} 个帖子中抓取评论...", 50)
-        comments_for_analysis = []
+        update_job_status(job_id, f"正在从 {len(final_submissions)} 个帖子中抓取评论...", 50)
         for submission in final_submissions:
-            submission.comments.replace_more(limit=0)
-            comments_for_analysis.extend([{"body": c.body, "score": c.score, "replies": len(c.replies), "permalink": f"https://www.reddit.com{c.permalink}"} for c in submission.comments.list()])
-        if not comments_for_analysis: raise ValueError("未能找到任何相关的评论。")
-        
-        comments_text = "\n".join([json.dumps(c, ensure_ascii=False) for c in comments_for_analysis])
+            if submission["id"] not in comment_futures:
+                comment_futures[submission["id"]] = comment_executor.submit(load_comments_cached, reddit, submission["id"], metrics)
+        # 评论抓取与搜索有重叠，这里记录的是搜索结束后还需等待评论的时间
+        with metrics.stage("reddit_comments"):
+            comment_lists = [comment_futures[submission["id"]].result() for submission in final_submissions]
+        metrics.add("comments_fetched", sum(len(records) for records in comment_lists))
+        stats["comment_watermarks"] = {submission["id"]: max([submission["created_utc"]] + [c.get("created_utc", 0) for c in records])
+                                       for submission, records in zip(final_submissions, comment_lists)}
+        comments = [strip_comment_time(c) for records in comment_lists for c in records if not blocklist.matches(c["body"])]
+    return final_submissions, comments, stats
 
-        update_status_file("数据整理完毕，正在请求 Gemini AI 分析...", 65)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        prompt = ""
-        if analysis_mode == 'pain_points':
-            prompt = f"""你是一位顶级的、专注于用户体验的产品经理。你的核心任务是从以下关于 "{keyword}" 的 Reddit 评论中，深度挖掘用户在**具体使用场景**中遇到的**真实痛点**。
+# --- 单个帖子的评论树抓取：展平成纯字典记录，不保留 PRAW 对象图 ---
+def load_submission_comments(reddit, submission_id, metrics, comment_sort=None):
+    from praw.endpoints import API_PATH
+    from praw.models import MoreComments
+    submission = reddit.submission(id=submission_id)
+    if comment_sort is not None:
+        submission.comment_sort = comment_sort
+    records = []
+    depth_by_id = {}
+    pending_children = []
+
+    def collect(items):
+        for item in items:
+            if len(records) >= COMMENT_MAX_PER_SUBMISSION:
+                return
+            parent_id = item.parent_id
+            if parent_id.startswith('t3_'):
+                depth = 0
+            elif parent_id[3:] in depth_by_id:
+                depth = depth_by_id[parent_id[3:]] + 1
+            else:
+                continue  # 父评论因深度上限被丢弃
+            if depth > COMMENT_MAX_DEPTH:
+                continue
+            if isinstance(item, MoreComments):
+                # count 为 0 的是 "继续此楼" 链接，需要单独翻页，直接忽略
+                if item.count > 0:
+                    pending_children.extend(item.children)
+                continue
+            depth_by_id[item.id] = depth
+            records.append({"id": item.id, "parent_id": parent_id[3:], "body": item.body, "score": item.score, "created_utc": item.created_utc, "permalink": f"https://www.reddit.com{item.permalink}"})
+
+    # 首次访问评论列表时抓取整棵评论树 (广度优先，父评论总在子评论之前)
+    reddit_rate_limiter.acquire()
+    metrics.add("reddit_api_calls")
+    collect(submission.comments.list())
+
+    # 把所有 "more" 占位节点的子评论 ID 汇总后按 100 个一批展开，而不是每个节点单独请求一次
+    batches = 0
+    while pending_children and batches < COMMENT_MORE_BATCHES and len(records) < COMMENT_MAX_PER_SUBMISSION:
+        batch, pending_children = pending_children[:MORE_CHILDREN_BATCH_SIZE], pending_children[MORE_CHILDREN_BATCH_SIZE:]
+        reddit_rate_limiter.acquire()
+        metrics.add("reddit_api_calls")
+        collect(reddit.post(API_PATH["morechildren"], data={"children": ",".join(batch), "link_id": f"t3_{submission_id}", "sort": submission.comment_sort}))
+        batches += 1
+
+    # 回复数 = 已加载的直接子评论数量，无需再遍历每条评论的 replies 森林
+    reply_counts = {}
+    for record in records:
+        reply_counts[record["parent_id"]] = reply_counts.get(record["parent_id"], 0) + 1
+    return [{"body": r["body"], "score": r["score"], "replies": reply_counts.get(r["id"], 0), "created_utc": r["created_utc"], "permalink": r["permalink"]} for r in records]
+
+# --- 带缓存的评论抓取 (在线程池中执行)，单个帖子失败不影响其它帖子 ---
+def load_comments_cached(reddit, submission_id, metrics):
+    try:
+        records = response_cache.get("comments", submission_id)
+        if records is None:
+            records = load_submission_comments(reddit, submission_id, metrics)
+            response_cache.set("comments", submission_id, records, COMMENT_CACHE_TTL)
+        return records
+    except Exception as e:
+        print(f"!!! [PRAW] 警告：抓取帖子 {submission_id} 的评论时出错: {e}。已跳过。!!!")
+        return []
+
+# 送去分析的评论记录不带发布时间，避免无谓地占用提示词长度
+def strip_comment_time(record):
+    return {key: value for key, value in record.items() if key != "created_utc"}
+
+# --- 增量模式：重新抓取已跟踪帖子的评论树 (按最新排序)，只保留晚于该帖子评论水位线的新评论 ---
+def refresh_tracked_threads(reddit, tracked_threads, limit, blocklist, metrics):
+    refresh_after = time.time() - INCREMENTAL_REFRESH_DAYS * 86400
+    candidates = sorted((submission_id for submission_id, thread in tracked_threads.items() if thread["created_utc"] >= refresh_after),
+                        key=lambda submission_id: tracked_threads[submission_id]["created_utc"], reverse=True)[:min(INCREMENTAL_REFRESH_THREADS, limit)]
+    if not candidates:
+        return [], {}
+
+    def refresh(submission_id):
+        try:
+            return load_submission_comments(reddit, submission_id, metrics, comment_sort="new")
+        except Exception as e:
+            print(f"!!! [PRAW] 警告：刷新帖子 {submission_id} 的评论时出错: {e}。保留原水位线。!!!")
+            return None
+
+    new_comments, comment_watermarks = [], {}
+    with ThreadPoolExecutor(max_workers=max(1, min(REDDIT_MAX_WORKERS, len(candidates))), thread_name_prefix="reddit-refresh") as executor:
+        for submission_id, records in zip(candidates, executor.map(refresh, candidates)):
+            if records is None:
+                continue
+            comment_watermark = tracked_threads[submission_id]["comment_watermark"]
+            fresh = [c for c in records if c["created_utc"] > comment_watermark]
+            comment_watermarks[submission_id] = max([comment_watermark] + [c["created_utc"] for c in fresh])
+            new_comments.extend(strip_comment_time(c) for c in fresh if not blocklist.matches(c["body"]))
+    metrics.add("comments_refreshed", len(new_comments))
+    print(f"--- [增量] 刷新了 {len(candidates)} 个已跟踪帖子，发现 {len(new_comments)} 条新评论")
+    return new_comments, comment_watermarks
+
+# --- 屏蔽词匹配器：每个任务编译一次，按整词匹配，耗时只与文本长度有关、与屏蔽词数量无关 ---
+BLOCKLIST_TOKEN_PATTERN = re.compile(r"\w+")
+
+class BlocklistMatcher:
+    def __init__(self, blocked_keywords):
+        self.words = set()
+        self.phrases = set()
+        self.max_phrase_length = 1
+        literal_patterns = []
+        for blocked_keyword in blocked_keywords:
+            term = " ".join(blocked_keyword.lower().split())
+            tokens = tuple(BLOCKLIST_TOKEN_PATTERN.findall(term))
+            if " ".join(tokens) != term:
+                # 含标点的屏蔽词 (如 "c++") 拆词后会变成更宽泛的 "c"，改为按原文整体匹配
+                print(f"--- [屏蔽词] '{blocked_keyword}' 含标点，将按原文整体匹配，而不是按拆分后的词 {list(tokens)} 匹配")
+                literal_patterns.append(r"\s+".join(map(re.escape, term.split())))
+            elif len(tokens) == 1:
+                self.words.add(tokens[0])
+            elif tokens:
+                # 多词屏蔽词 (如 "how to") 按连续词组匹配
+                self.phrases.add(tokens)
+                self.max_phrase_length = max(self.max_phrase_length, len(tokens))
+        self.literal_pattern = re.compile(r"(?<!\w)(?:" + "|".join(literal_patterns) + r")(?!\w)") if literal_patterns else None
+
+    def matches(self, *texts):
+        for text in texts:
+            if not text:
+                continue
+            lowered = text.lower()
+            if self.literal_pattern is not None and self.literal_pattern.search(lowered):
+                return True
+            tokens = BLOCKLIST_TOKEN_PATTERN.findall(lowered)
+            if not self.words.isdisjoint(tokens):
+                return True
+            for length in range(2, self.max_phrase_length + 1):
+                if any(phrase in self.phrases for phrase in zip(*(tokens[i:] for i in range(length)))):
+                    return True
+        return False
+
+# --- 评论预筛选：剔除低信息量评论，合并近似重复，按 相关性 x 互动度 排序后取预算内的最优子集 ---
+LOW_INFO_BODIES = {"[deleted]", "[removed]", ""}
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+# 近似去重用 bottom-k MinHash：保留最小的 16 个片段哈希作为签名，最小的 3 个哈希用作分桶键；
+# 每个桶只保留排名最靠前的 8 个签名，词汇量很小的语料里常见片段的桶不会无限变长
+MINHASH_SIZE = 16
+MINHASH_BUCKET_KEYS = 3
+MAX_BUCKET_SIZE = 8
+
+def comment_signature(words):
+    # 以 3 词片段为单位，每个片段只哈希一次，排序和取交集都在 C 层完成
+    shingles = set(map(hash, zip(words, words[1:], words[2:]))) or {hash(tuple(words))}
+    signature = sorted(shingles)[:MINHASH_SIZE]
+    return signature, frozenset(signature)
+
+def is_near_duplicate(signature, other):
+    (hashes, hash_set), (other_hashes, other_set) = signature, other
+    shared = hash_set & other_set
+    # 估计值的分子不超过共享哈希数，分母不小于 min(k, 较大签名的长度)；大多数比较在这里就能排除
+    if len(shared) < DUPLICATE_SIMILARITY * min(MINHASH_SIZE, max(len(hashes), len(other_hashes))):
+        return False
+    union_sketch = sorted(hash_set | other_set)[:MINHASH_SIZE]
+    return sum(1 for h in union_sketch if h in shared) >= DUPLICATE_SIMILARITY * len(union_sketch)
+
+def select_comments(keyword, comments, budget_chars):
+    keyword_terms = sorted(set(WORD_PATTERN.findall(keyword.lower())), key=len, reverse=True)
+    keyword_pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, keyword_terms)) + r")\b") if keyword_terms else None
+    stats = {"total": len(comments), "kept": 0, "low_info": 0, "duplicates": 0, "over_budget": 0}
+
+    ranked = []
+    for comment in comments:
+        body = (comment.get("body") or "").strip()
+        if body in LOW_INFO_BODIES or len(body.split()) < MIN_COMMENT_WORDS:
+            stats["low_info"] += 1
+            continue
+        lowered = body.lower()
+        relevance = 1 + (len(set(keyword_pattern.findall(lowered))) if keyword_pattern else 0)
+        engagement = 1 + math.log1p(max(comment.get("score", 0) or 0, 0)) + 0.5 * math.log1p(comment.get("replies", 0) or 0)
+        ranked.append((relevance * engagement, lowered, comment))
+    ranked.sort(key=lambda entry: entry[0], reverse=True)
+
+    selected, buckets, used_chars = [], {}, 0
+    for _, lowered, comment in ranked:
+        # 按 JSON 行长度估算占用的字符预算，放不下的评论不再计算签名
+        line_chars = len(comment["body"]) + len(comment.get("permalink", "")) + 60
+        if used_chars + line_chars > budget_chars:
+            stats["over_budget"] += 1
+            continue
+        signature = comment_signature(WORD_PATTERN.findall(lowered))
+        smallest = signature[0][:MINHASH_BUCKET_KEYS]
+        # 分桶键取最小几个哈希的两两组合：高度相似的评论几乎总有两个最小哈希相同，而常见片段单独作为键时桶会过大
+        bucket_keys = [(smallest[i], smallest[j]) for i in range(len(smallest)) for j in range(i + 1, len(smallest))] or smallest
+        if any(is_near_duplicate(signature, other) for key in bucket_keys for other in buckets.get(key, ())):
+            stats["duplicates"] += 1
+            continue
+        for key in bucket_keys:
+            bucket = buckets.setdefault(key, [])
+            if len(bucket) < MAX_BUCKET_SIZE:
+                bucket.append(signature)
+        selected.append(comment)
+        used_chars += line_chars
+
+    stats["kept"] = len(selected)
+    return selected, stats
+
+# --- AI 分析：按记录边界切块，分块并发提取，再合并成报告所需的结构 ---
+ANALYSIS_SCHEMAS = {
+    'pain_points': {"main_key": "identifiedPainPoints", "example_key": "painPointTitle", "item_name": "痛点", "final_count": "3-5"},
+    'hot_topics': {"main_key": "keyDiscussionTopics", "example_key": "associatedTopic", "item_name": "议题", "final_count": "5-8"},
+}
+
+def extract_json(response_text):
+    match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if not match:
+        print("--- AI原始返回内容 ---\n" + response_text + "\n--------------------")
+        raise ValueError("AI响应格式不正确，任务中断。")
+    return json.loads(match.group(0))
+
+# 模型返回的计数可能是字符串 (如 "12"、"约12") 或缺失，无法解析时按 0 处理，不让单个分块的格式问题中断整个任务
+def parse_count(value):
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        return max(int(value), 0) if math.isfinite(value) else 0
+    match = re.search(r"\d+", value) if isinstance(value, str) else None
+    return int(match.group(0)) if match else 0
+
+def split_comment_chunks(comments_for_analysis):
+    chunk_chars = ANALYSIS_CHUNK_TOKENS * CHARS_PER_TOKEN
+    chunks, current_lines, current_chars = [], [], 0
+    for comment in comments_for_analysis:
+        line = json.dumps(comment, ensure_ascii=False)
+        if len(line) > chunk_chars:
+            # 超长评论单独截断正文，保证每行仍是完整的 JSON 记录
+            line = json.dumps(dict(comment, body=comment["body"][:chunk_chars // 2]), ensure_ascii=False)
+        if current_lines and current_chars + len(line) + 1 > chunk_chars:
+            chunks.append("\n".join(current_lines))
+            current_lines, current_chars = [], 0
+        current_lines.append(line)
+        current_chars += len(line) + 1
+    if current_lines:
+        chunks.append("\n".join(current_lines))
+    if len(chunks) > MAX_ANALYSIS_CHUNKS:
+        print(f"--- [AI分析] 评论共 {len(chunks)} 块，超过上限 {MAX_ANALYSIS_CHUNKS}，仅分析前 {MAX_ANALYSIS_CHUNKS} 块。")
+        chunks = chunks[:MAX_ANALYSIS_CHUNKS]
+    return chunks
+
+def build_full_prompt(keyword, analysis_mode, comments_text):
+    if analysis_mode == 'pain_points':
+        return f"""你是一位顶级的、专注于用户体验的产品经理。你的核心任务是从以下关于 "{keyword}" 的 Reddit 评论中，深度挖掘用户在**具体使用场景**中遇到的**真实痛点**。
             你的任务要求：1. **聚焦负面体验**。2. **忽略无关内容**。3. **总结3-5个核心痛点**。4. **严格的JSON格式**，特别是 executiveSummary 必须是一个包含 overallSentiment 和 keyFindings 数组的JSON对象。
             {{
                 "executiveSummary": {{ "overallSentiment": "在这里用一句话概述最重要的发现。", "keyFindings": ["发现一", "发现二", "发现三"] }},
                 "identifiedPainPoints": [{{"title": "痛点标题", "usageScenario": "痛点发生的使用场景", "description": "详细描述痛点", "count": 0}}],
                 "chartData": {{"labels": ["痛点一"], "data": [0], "colors": ["#D2B48C", "#E9DDc7", "#856404"]}},
                 "commentExamples": [{{"painPointTitle": "所属痛点标题", "commentTranslation": "将代表性评论翻译成中文", "score": 0, "replies": 0, "permalink": "评论URL"}}]
-            }} --- 原始评论数据 --- {comments_text[:TOTAL_CHARS_LIMIT]}"""
-        else: # hot_topics
-            prompt = f"""你是一位敏锐的市场研究专家。你的任务是从以下关于 "{keyword}" 的 Reddit 评论中，总结出热门的讨论主题和用户的主流观点。
+            }} --- 原始评论数据 --- {comments_text}"""
+    return f"""你是一位敏锐的市场研究专家。你的任务是从以下关于 "{keyword}" 的 Reddit 评论中，总结出热门的讨论主题和用户的主流观点。
             你的任务要求：1. **识别5-8个核心议题**。2. **总结主流观点**。3. **严格的JSON格式**，特别是 executiveSummary 必须是一个包含 overallSentiment 和 keyFindings 数组的JSON对象。
             {{
                 "executiveSummary": {{ "overallSentiment": "在这里用一句话概述最重要的发现。", "keyFindings": ["发现一", "发现二", "发现三"] }},
                 "keyDiscussionTopics": [{{"title": "议题标题", "description": "概括主流观点", "count": 0}}],
                 "chartData": {{"labels": ["议题一"], "data": [0], "colors": ["#D2B48C", "#E9DDc7", "#856404"]}},
                 "commentExamples": [{{"associatedTopic": "所属议题标题", "commentTranslation": "将代表性评论翻译成中文", "score": 0, "replies": 0, "permalink": "评论URL"}}]
-            }} --- 原始评论数据 --- {comments_text[:TOTAL_CHARS_LIMIT]}"""
-            
-        response = model.generate_content(prompt)
+            }} --- 原始评论数据 --- {comments_text}"""
+
+def build_map_prompt(keyword, analysis_mode, comments_text, chunk_index, chunk_total):
+    schema = ANALYSIS_SCHEMAS[analysis_mode]
+    if analysis_mode == 'pain_points':
+        task = f'你是一位顶级的、专注于用户体验的产品经理。请从以下关于 "{keyword}" 的 Reddit 评论中挖掘用户在**具体使用场景**中遇到的**真实痛点**，聚焦负面体验，忽略无关内容。'
+        item_format = '{"title": "痛点标题", "usageScenario": "痛点发生的使用场景", "description": "详细描述痛点", "count": 0}'
+    else:
+        task = f'你是一位敏锐的市场研究专家。请从以下关于 "{keyword}" 的 Reddit 评论中总结热门的讨论主题和用户的主流观点。'
+        item_format = '{"title": "议题标题", "description": "概括主流观点", "count": 0}'
+    return f"""{task}
+            这是全部评论中的第 {chunk_index}/{chunk_total} 批。count 必须是本批评论中提及该{schema["item_name"]}的评论条数。只返回严格的JSON：
+            {{
+                "{schema["main_key"]}": [{item_format}],
+                "commentExamples": [{{"{schema["example_key"]}": "所属{schema["item_name"]}标题", "commentTranslation": "将代表性评论翻译成中文", "score": 0, "replies": 0, "permalink": "评论URL"}}]
+            }} --- 原始评论数据 --- {comments_text}"""
+
+def build_reduce_prompt(keyword, analysis_mode, candidates):
+    schema = ANALYSIS_SCHEMAS[analysis_mode]
+    candidates_text = "\n".join(json.dumps(candidate, ensure_ascii=False) for candidate in candidates)
+    extra_field = '"usageScenario": "使用场景", ' if analysis_mode == 'pain_points' else ''
+    return f"""以下是从多批关于 "{keyword}" 的 Reddit 评论中分别提取出的候选{schema["item_name"]}，每一项都有唯一的 id。
+            你的任务要求：1. **合并含义相同或相近的候选项**，最终保留{schema["final_count"]}个核心{schema["item_name"]}。2. 用 sourceIds 列出每个最终{schema["item_name"]}合并了哪些候选 id，每个 id 最多出现一次。3. **严格的JSON格式**，特别是 executiveSummary 必须是一个包含 overallSentiment 和 keyFindings 数组的JSON对象。
+            {{
+                "executiveSummary": {{ "overallSentiment": "在这里用一句话概述最重要的发现。", "keyFindings": ["发现一", "发现二", "发现三"] }},
+                "{schema["main_key"]}": [{{"title": "标题", {extra_field}"description": "描述", "sourceIds": [0]}}]
+            }} --- 候选列表 --- {candidates_text}"""
+
+def merge_partial_results(analysis_mode, reduce_result, candidates, examples_by_candidate):
+    schema = ANALYSIS_SCHEMAS[analysis_mode]
+    counts_by_id = {candidate["id"]: candidate["count"] for candidate in candidates}
+    used_ids = set()
+    final_items = []
+    for item in reduce_result.get(schema["main_key"], []):
+        source_ids = []
+        for source_id in item.get("sourceIds") or []:
+            source_id = int(source_id) if str(source_id).isdigit() else None
+            if source_id in counts_by_id and source_id not in used_ids:
+                source_ids.append(source_id)
+        used_ids.update(source_ids)
+        merged_item = {key: value for key, value in item.items() if key != "sourceIds"}
+        # 计数由各分块结果直接相加，不依赖模型在合并时重新估算
+        merged_item["count"] = sum(counts_by_id[source_id] for source_id in source_ids) if source_ids else parse_count(item.get("count"))
+        merged_item["_source_ids"] = source_ids
+        final_items.append(merged_item)
+    final_items.sort(key=lambda item: item["count"], reverse=True)
+
+    comment_examples = []
+    for item in final_items:
+        examples = [example for source_id in item.pop("_source_ids") for example in examples_by_candidate.get(source_id, [])]
+        examples.sort(key=lambda example: example.get("score", 0) or 0, reverse=True)
+        for example in examples[:COMMENT_EXAMPLES_PER_ITEM]:
+            comment_examples.append(dict(example, **{schema["example_key"]: item["title"]}))
+
+    return {
+        "executiveSummary": reduce_result.get("executiveSummary", {}),
+        schema["main_key"]: final_items,
+        "chartData": {
+            "labels": [item["title"] for item in final_items],
+            "data": [item["count"] for item in final_items],
+            "colors": [CHART_COLORS[i % len(CHART_COLORS)] for i in range(len(final_items))],
+        },
+        "commentExamples": comment_examples,
+    }
+
+# 传入 previous_report 时为增量分析：上次的结果作为一组已有候选，与新评论的分块结果一起合并，计数累加
+def analyze_comments(job_id, keyword, analysis_mode, comments_for_analysis, metrics, previous_report=None):
+    model = get_gemini_model()
+    chunks = split_comment_chunks(comments_for_analysis)
+    metrics.add("analysis_chunks", len(chunks))
+    if len(chunks) == 1 and previous_report is None:
+        response = call_gemini(model, build_full_prompt(keyword, analysis_mode, chunks[0]), metrics)
+        update_job_status(job_id, "AI响应已收到，准备解析JSON...", 85)
+        with metrics.call("json_extraction"):
+            return extract_json(response.text)
+
+    schema = ANALYSIS_SCHEMAS[analysis_mode]
+    print(f"--- [AI分析] 评论被切分为 {len(chunks)} 块，并发提取中...")
+
+    def analyze_chunk(chunk_index):
+        try:
+            response = call_gemini(model, build_map_prompt(keyword, analysis_mode, chunks[chunk_index], chunk_index + 1, len(chunks)), metrics)
+            with metrics.call("json_extraction"):
+                return extract_json(response.text)
+        except Exception as e:
+            print(f"!!! [AI分析] 警告：第 {chunk_index + 1} 块分析失败: {e}。已跳过。!!!")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, len(chunks)), thread_name_prefix="gemini-map") as executor:
+        partial_results = list(executor.map(analyze_chunk, range(len(chunks))))
+    if not any(partial_results):
+        raise ValueError("所有评论分块的 AI 分析均失败，任务中断。")
+    update_job_status(job_id, "AI 分块分析完成，正在合并结果...", 85)
+
+    candidates, examples_by_candidate = [], {}
+    # 上次的报告与分块结果结构相同 (主列表 + commentExamples)，可以直接作为一组候选
+    for partial in [previous_report] + partial_results:
+        if not partial:
+            continue
+        ids_by_title = {}
+        for item in partial.get(schema["main_key"], []):
+            if not isinstance(item, dict):
+                continue
+            candidate = {key: value for key, value in item.items() if key in ("title", "usageScenario", "description")}
+            candidate["id"] = len(candidates)
+            candidate["count"] = parse_count(item.get("count"))
+            ids_by_title[item.get("title")] = candidate["id"]
+            candidates.append(candidate)
+        for example in partial.get("commentExamples", []):
+            if not isinstance(example, dict):
+                continue
+            candidate_id = ids_by_title.get(example.get(schema["example_key"]))
+            if candidate_id is not None:
+                examples_by_candidate.setdefault(candidate_id, []).append(example)
+
+    response = call_gemini(model, build_reduce_prompt(keyword, analysis_mode, candidates), metrics)
+    with metrics.call("json_extraction"):
+        reduce_result = extract_json(response.text)
+    return merge_partial_results(analysis_mode, reduce_result, candidates, examples_by_candidate)
+
+# --- 核心任务执行函数 (双引擎 + 幽灵数据修复版) ---
+def real_task_runner(job_id, keyword, timeframe, sort_order, limit, search_mode, blocked_keywords, analysis_mode, incremental=False):
+    print(f"--- [演员上台] Job: {job_id}, Keyword: {keyword}, Mode: {analysis_mode} ---")
+    metrics = JobMetrics()
+    task_started_at = time.perf_counter()
+    try:
+        subreddits_for_this_task = ""
+        if search_mode == "smart":
+            subreddits_for_this_task = get_ai_subreddits(job_id, keyword, metrics)
+        elif search_mode == "standard":
+            subreddits_for_this_task = SUBREDDITS_TO_SEARCH
         
-        update_status_file("AI响应已收到，准备解析JSON...", 85)
-        match = re.search(r'\{.*\}', response.text, re.DOTALL)
-        if not match:
-            print("--- AI原始返回内容 ---\n" + response.text + "\n--------------------")
-            raise ValueError("AI响应格式不正确，任务中断。")
-            
-        report_data_json = json.loads(match.group(0))
+        update_job_status(job_id, "正在连接 Reddit...", 20)
+        reddit = get_reddit_client()
+        
+        individual_subreddits = ['all'] if search_mode == 'all_reddit' else [s.replace('r/', '') for s in subreddits_for_this_task.split('+') if s]
+        if not individual_subreddits: raise ValueError("未能确定任何要搜索的版块。")
+
+        # 增量模式：同一 (关键词, 版块集合, 分析模式) 只抓取水位线之后的新帖子和已跟踪帖子下的新评论，并在上次结果的基础上合并
+        # 状态保存在不参与大小淘汰的状态表中，普通缓存的换入换出不会让增量运行悄悄退化成全量运行
+        state_key = [keyword.strip().lower(), sorted(individual_subreddits), analysis_mode]
+        previous_state = response_cache.get_state("incremental_state", state_key) if incremental else None
+        tracked_threads = previous_state["threads"] if previous_state else {}
+        pending_submissions = previous_state.get("pending", []) if previous_state else []
+        if previous_state is not None:
+            print(f"--- [增量] 上次水位线 {previous_state['watermark']}，已跟踪 {len(tracked_threads)} 个帖子")
+
+        update_job_status(job_id, f"在 {len(individual_subreddits)} 个版块中搜索...", 25)
+        blocklist = BlocklistMatcher(blocked_keywords)
+        final_submissions, comments_for_analysis, fetch_stats = run_fetch_pipeline(job_id, reddit, individual_subreddits, keyword, timeframe, sort_order, int(limit), analysis_mode, blocklist, metrics,
+                                                                                   since=previous_state["watermark"] if previous_state else None,
+                                                                                   seen_ids=frozenset(tracked_threads).union(s["id"] for s in pending_submissions),
+                                                                                   pending=pending_submissions)
+        refreshed_watermarks = {}
+        if tracked_threads:
+            update_job_status(job_id, "正在检查已跟踪帖子下的新评论...", 55)
+            refreshed_comments, refreshed_watermarks = refresh_tracked_threads(reddit, tracked_threads, int(limit), blocklist, metrics)
+            comments_for_analysis = comments_for_analysis + refreshed_comments
 
-        update_status_file("AI 分析完成，正在生成HTML报告...", 90)
-        report_html = generate_report_html(json.dumps(report_data_json), keyword, individual_subreddits, analysis_mode)
+        print(f"--- [主任务] 筛选完成，最终选定 {len(final_submissions)} 个帖子进行分析。")
+        if previous_state is None:
+            if not final_submissions: raise ValueError(f"未能找到关于 '{keyword}' 的有效帖子 (可能均被屏蔽词过滤)。请尝试“市场热点分析”模式或更换关键词。")
+            if not comments_for_analysis: raise ValueError("未能找到任何相关的评论。")
+
+        if comments_for_analysis:
+            with metrics.stage("comment_selection"):
+                comments_for_analysis, selection_stats = select_comments(keyword, comments_for_analysis, ANALYSIS_CHUNK_TOKENS * CHARS_PER_TOKEN * MAX_ANALYSIS_CHUNKS)
+            metrics.add("comments_selected", selection_stats["kept"])
+            print(f"--- [评论筛选] {selection_stats}")
+            update_job_status(job_id, f"评论筛选完成：保留 {selection_stats['kept']} 条，丢弃 {selection_stats['total'] - selection_stats['kept']} 条", 60)
+        if not comments_for_analysis and previous_state is None: raise ValueError("筛选后没有足够有信息量的评论可供分析。")
+
+        if comments_for_analysis:
+            update_job_status(job_id, "数据整理完毕，正在请求 Gemini AI 分析...", 65)
+            with metrics.stage("gemini_analysis"):
+                report_data_json = analyze_comments(job_id, keyword, analysis_mode, comments_for_analysis, metrics, previous_report=previous_state["report"] if previous_state else None)
+        else:
+            update_job_status(job_id, "没有发现新的帖子或评论，沿用上次的分析结果...", 85)
+            report_data_json = previous_state["report"]
+
+        if incremental:
+            threads = {submission_id: dict(thread, comment_watermark=refreshed_watermarks.get(submission_id, thread["comment_watermark"])) for submission_id, thread in tracked_threads.items()}
+            for submission in final_submissions:
+                threads[submission["id"]] = {"created_utc": submission["created_utc"], "comment_watermark": fetch_stats["comment_watermarks"].get(submission["id"], submission["created_utc"])}
+            newest_threads = sorted(threads, key=lambda submission_id: threads[submission_id]["created_utc"], reverse=True)[:INCREMENTAL_SEEN_LIMIT]
+            response_cache.set_state("incremental_state", state_key, {
+                "watermark": fetch_stats["watermark"],
+                "threads": {submission_id: threads[submission_id] for submission_id in newest_threads},
+                "pending": fetch_stats["pending"],
+                "report": report_data_json,
+            }, INCREMENTAL_STATE_TTL)
+
+        update_job_status(job_id, "AI 分析完成，正在生成HTML报告...", 90)
+        with metrics.stage("report_rendering"):
+            report_html = generate_report_html(json.dumps(report_data_json), keyword, individual_subreddits, analysis_mode)
         
-        update_status_file("报告生成完毕，正在保存文件...", 95)
+        update_job_status(job_id, "报告生成完毕，正在保存文件...", 95)
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        report_filename = f"report_{keyword.replace(' ','_')}_{timestamp}.html"
-        report_filepath = os.path.join('static', report_filename)
-        with open(report_filepath, 'w', encoding='utf-8') as f:
-            f.write(report_html)
+        report_filename = f"report_{keyword.replace(' ','_')}_{timestamp}_{job_id}.html"
+        report_filepath = os.path.join(app.static_folder, report_filename)
+        with metrics.stage("report_writing"):
+            with open(report_filepath, 'w', encoding='utf-8') as f:
+                f.write(report_html)
             
-        update_status_file("已完成", 100, report_url=f"/static/{report_filename}")
+        update_job_status(job_id, "已完成", 100, report_url=f"/static/{report_filename}", metrics=finish_job_metrics(metrics, task_started_at, "done"))
 
     except Exception as e:
         print(f"!!! [主任务] 任务执行过程中发生严重错误: {e} !!!")
-        update_status_file(f"任务出错: {str(e)}", 100)
+        update_job_status(job_id, f"任务出错: {str(e)}", 100, metrics=finish_job_metrics(metrics, task_started_at, "failed"))
+
+def finish_job_metrics(metrics, task_started_at, state):
+    metrics.record_stage("total", time.perf_counter() - task_started_at)
+    snapshot = metrics.snapshot()
+    metrics_registry.record_job(snapshot, state)
+    print(f"--- [指标] {snapshot}")
+    return snapshot
 
 # --- Flask 路由 (带锁) ---
 @app.route('/')
@@ -336,47 +1377,118 @@ def favicon():
 
 @app.route('/start-task', methods=['POST'])
 def start_task():
+    job_id = None
     try:
-        with file_lock:
-            initial_state = { "status": "任务初始化...", "progress": 0, "report_url": "", "ai_subreddits": None }
-            with open(STATUS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(initial_state, f, ensure_ascii=False)
-
         data = request.json
         print(f"--- [导演接收剧本] Keyword: {data.get('keyword')}, Mode: {data.get('analysis_mode')}")
-        
+
+        job_id = create_job()
+        if job_id is None:
+            return jsonify({"message": "当前排队任务过多，请稍后再试"}), 429
+
         # 关键修复：使用安全的默认值获取方式
         blocked_keywords_from_frontend = data.get('blocked_keywords')
         final_blocked_keywords = blocked_keywords_from_frontend if blocked_keywords_from_frontend is not None else DEFAULT_BLOCKED_KEYWORDS.copy()
 
-        thread = threading.Thread(target=real_task_runner, args=(
+        job_executor.submit(run_job, job_id,
             data.get('keyword'), 
             data.get('timeframe', 'year'), 
             data.get('sort_order', 'relevance'), 
             data.get('limit', 10), 
             data.get('subreddits', 'smart'), 
             final_blocked_keywords, 
-            data.get('analysis_mode', 'pain_points')
-        ))
-        thread.start()
-        return jsonify({"message": "任务已成功启动"})
+            data.get('analysis_mode', 'pain_points'),
+            bool(data.get('incremental', False))
+        )
+        return jsonify({"message": "任务已成功启动", "job_id": job_id})
     except Exception as e:
         print(f"!!! 任务启动失败: {e} !!!")
-        update_status_file(f"任务启动失败: {str(e)}", 100)
+        if job_id is not None:
+            update_job_status(job_id, f"任务启动失败: {str(e)}", 100)
         return jsonify({"message": "任务启动失败"}), 500
 
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics_registry.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify(response_cache.get_stats())
+
+@app.route('/task-status/<job_id>')
+def job_status(job_id):
+    status_data = get_job_status(job_id)
+    if status_data is None:
+        return jsonify({"status": "任务不存在或已过期", "progress": 100, "report_url": ""}), 404
+    return jsonify(status_data)
+
+# 推送任务进度 (Server-Sent Events)：每次状态变化推送一次完整状态，任务结束后关闭连接
+@app.route('/task-events/<job_id>')
+def task_events(job_id):
+    global active_sse_streams
+    if get_job_status(job_id) is None:
+        return jsonify({"message": "任务不存在或已过期"}), 404
+    with sse_lock:
+        if active_sse_streams >= SSE_MAX_STREAMS:
+            return jsonify({"message": "推送连接已满，请改用轮询"}), 503
+        active_sse_streams += 1
+
+    def release_stream():
+        global active_sse_streams
+        with sse_lock:
+            active_sse_streams -= 1
+
+    def event_stream():
+        last_version = None
+        while True:
+            with jobs_changed:
+                jobs_changed.wait_for(lambda: job_versions.get(job_id, 0) != last_version or job_id not in jobs, timeout=SSE_HEARTBEAT_SECONDS)
+                job = jobs.get(job_id)
+                snapshot = dict(job) if job is not None else None
+                version = job_versions.get(job_id, 0)
+            if snapshot is None:
+                return
+            if version == last_version:
+                # 心跳注释行，用于及时发现已断开的连接
+                yield ": keep-alive\n\n"
+                continue
+            last_version = version
+            yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            if snapshot["progress"] >= 100:
+                return
+
+    response = Response(event_stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(release_stream)
+    return response
+
+# 兼容旧版前端：返回最近提交的任务状态
 @app.route('/task-status')
 def task_status():
-    try:
-        with file_lock:
-            with open(STATUS_FILE, 'r', encoding='utf-8') as f:
-                status_data = json.load(f)
-        return jsonify(status_data)
-    except (FileNotFoundError, json.JSONDecodeError):
+    with jobs_lock:
+        latest_job_id = next(reversed(jobs), None)
+    if latest_job_id is None:
         return jsonify({"status": "等待任务启动...", "progress": 0, "report_url": ""})
+    return jsonify(get_job_status(latest_job_id))
 
 # --- 服务器启动 ---
+load_jobs()
+
+metrics_registry.startup_seconds = round(time.perf_counter() - STARTUP_STARTED_AT, 4)
+if metrics_registry.startup_seconds * 1000 > STARTUP_BUDGET_MS:
+    print(f"!!! [启动] 启动耗时 {metrics_registry.startup_seconds * 1000:.0f}ms，超出预算 {STARTUP_BUDGET_MS:.0f}ms !!!")
+else:
+    print(f"--- [启动] 启动耗时 {metrics_registry.startup_seconds * 1000:.0f}ms (预算 {STARTUP_BUDGET_MS:.0f}ms) ---")
 print("\n--- 准备启动服务器 ---")
+def prewarm_clients():
+    for name, getter in (("reddit", get_reddit_client), ("gemini", get_gemini_model)):
+        try:
+            getter()
+        except Exception as e:
+            print(f"!!! [客户端] {name} 预加载失败，将在第一个任务中重试: {e} !!!")
+
 if __name__ == '__main__':
+    from waitress import serve
+    if PREWARM_CLIENTS:
+        threading.Thread(target=prewarm_clients, name="prewarm-clients", daemon=True).start()
     print("--- 使用 Waitress 服务器启动 ---")
     serve(app, host='0.0.0.0', port=5000, threads=8)
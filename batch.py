@@ -0,0 +1,145 @@
+# --- 批量命令行模式：不启动 Web 服务，直接从任务清单批量运行多个关键词，共享同一套客户端、缓存和限流器 ---
+# 任务清单每行一个任务：JSON 对象 (字段与 /start-task 相同) 或者单独一个关键词；空行和 # 开头的行会被忽略
+#   {"keyword": "blackout curtain", "analysis_mode": "pain_points", "limit": 20}
+#   {"keyword": "robot vacuum", "analysis_mode": "hot_topics", "subreddits": "all_reddit", "incremental": true}
+#   standing desk
+# 用法示例:
+#   python batch.py keywords.jsonl --concurrency 4 --reddit-qps 1.5 --summary batch_summary.json --reports-dir reports/
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import as_completed
+
+SPEC_FIELDS = ("keyword", "timeframe", "sort_order", "limit", "subreddits", "blocked_keywords", "analysis_mode", "incremental")
+# 任务清单和命令行参数共用同一组取值，非法值在提交任何任务之前就报错
+SPEC_CHOICES = {
+    "timeframe": ("hour", "day", "week", "month", "year", "all"),
+    "sort_order": ("relevance", "hot", "top", "new"),
+    "subreddits": ("smart", "standard", "all_reddit"),
+    "analysis_mode": ("pain_points", "hot_topics"),
+}
+
+
+def load_specs(path, defaults):
+    specs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            spec = json.loads(line) if line.startswith('{') else {"keyword": line}
+            unknown_fields = set(spec) - set(SPEC_FIELDS)
+            if unknown_fields:
+                raise ValueError(f"第 {line_number} 行包含未知字段: {', '.join(sorted(unknown_fields))}")
+            if not str(spec.get("keyword") or "").strip():
+                raise ValueError(f"第 {line_number} 行缺少 keyword")
+            spec = {**defaults, **spec}
+            for field, choices in SPEC_CHOICES.items():
+                if spec[field] not in choices:
+                    raise ValueError(f"第 {line_number} 行的 {field} 取值无效: {spec[field]!r} (可选: {', '.join(choices)})")
+            if isinstance(spec["limit"], bool) or not isinstance(spec["limit"], int) or spec["limit"] < 1:
+                raise ValueError(f"第 {line_number} 行的 limit 必须是正整数: {spec['limit']!r}")
+            specs.append({**spec, "line": line_number})
+    return specs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量运行关键词分析任务，输出 HTML 报告和 JSON 汇总")
+    parser.add_argument("specs", help="任务清单文件 (每行一个 JSON 对象或关键词)")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时运行的任务数")
+    parser.add_argument("--reddit-qps", type=float, help="所有任务共享的 Reddit 每秒请求预算 (默认沿用 REDDIT_REQUESTS_PER_SECOND)")
+    parser.add_argument("--gemini-concurrency", type=int, help="所有任务同时发往 Gemini 的请求上限 (默认沿用 GEMINI_MAX_CONCURRENT_CALLS)")
+    parser.add_argument("--timeframe", default="year", choices=SPEC_CHOICES["timeframe"])
+    parser.add_argument("--sort-order", default="relevance", choices=SPEC_CHOICES["sort_order"])
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--subreddits", default="smart", choices=SPEC_CHOICES["subreddits"])
+    parser.add_argument("--analysis-mode", default="pain_points", choices=SPEC_CHOICES["analysis_mode"])
+    parser.add_argument("--incremental", action="store_true", help="默认对所有任务启用增量模式")
+    parser.add_argument("--reports-dir", help="把生成的报告移动到该目录 (默认保留在 static/ 下)")
+    parser.add_argument("--summary", help="JSON 汇总文件路径 (默认 batch_summary_<时间>.json)")
+    args = parser.parse_args()
+
+    defaults = {"timeframe": args.timeframe, "sort_order": args.sort_order, "limit": args.limit, "subreddits": args.subreddits,
+                "blocked_keywords": None, "analysis_mode": args.analysis_mode, "incremental": args.incremental}
+    specs = load_specs(args.specs, defaults)
+    if not specs:
+        print("!!! 任务清单为空 !!!")
+        return 1
+
+    # 必须在导入 app 之前设置：调度器大小、排队上限和历史上限按本批任务数放开，不覆盖 Web 服务的任务快照
+    os.environ["MAX_CONCURRENT_JOBS"] = str(max(1, args.concurrency))
+    os.environ["MAX_QUEUED_JOBS"] = str(len(specs))
+    os.environ["JOB_HISTORY_LIMIT"] = str(len(specs))
+    os.environ["JOB_PERSIST"] = "0"
+    if args.reddit_qps is not None:
+        os.environ["REDDIT_REQUESTS_PER_SECOND"] = str(args.reddit_qps)
+    if args.gemini_concurrency is not None:
+        os.environ["GEMINI_MAX_CONCURRENT_CALLS"] = str(max(1, args.gemini_concurrency))
+    import app
+
+    if args.reports_dir:
+        os.makedirs(args.reports_dir, exist_ok=True)
+    print(f"--- [批量] 共 {len(specs)} 个任务，并发 {app.MAX_CONCURRENT_JOBS}，Reddit {app.REDDIT_REQUESTS_PER_SECOND} 次/秒，Gemini 并发 {app.GEMINI_MAX_CONCURRENT_CALLS} ---")
+
+    started_at = time.time()
+    futures = {}
+    for spec in specs:
+        job_id = app.create_job()
+        blocked_keywords = spec["blocked_keywords"] if spec["blocked_keywords"] is not None else app.DEFAULT_BLOCKED_KEYWORDS.copy()
+        future = app.job_executor.submit(app.run_job, job_id, spec["keyword"], spec["timeframe"], spec["sort_order"], spec["limit"],
+                                         spec["subreddits"], blocked_keywords, spec["analysis_mode"], bool(spec["incremental"]))
+        futures[future] = (job_id, spec)
+
+    def collect_result(job_id, spec):
+        status = app.get_job_status(job_id)
+        report_path = None
+        if status.get("report_url"):
+            report_path = os.path.join(app.app.static_folder, os.path.basename(status["report_url"]))
+            if args.reports_dir:
+                report_path = shutil.move(report_path, os.path.join(args.reports_dir, os.path.basename(report_path)))
+            report_path = os.path.abspath(report_path)
+        return {**spec, "job_id": job_id, "state": status["state"], "status": status["status"], "report_path": report_path,
+                "ai_subreddits": status.get("ai_subreddits"), "metrics": status.get("metrics")}
+
+    results = []
+    try:
+        for finished, future in enumerate(as_completed(futures), 1):
+            job_id, spec = futures[future]
+            results.append(collect_result(job_id, spec))
+            print(f"=== [批量] {finished}/{len(specs)} '{spec['keyword']}': {results[-1]['status']} ===")
+    except KeyboardInterrupt:
+        print("!!! [批量] 收到中断信号，取消尚未开始的任务，等待运行中的任务结束... !!!")
+        app.job_executor.shutdown(wait=True, cancel_futures=True)
+
+    # 中断时等待期间结束的任务仍有真实状态和报告，只有从未开始的任务才记为取消
+    finished_ids = {result["job_id"] for result in results}
+    for job_id, spec in futures.values():
+        if job_id in finished_ids:
+            continue
+        if app.get_job_status(job_id)["state"] in ("done", "failed"):
+            results.append(collect_result(job_id, spec))
+        else:
+            results.append({**spec, "job_id": job_id, "state": "cancelled", "status": "未运行", "report_path": None, "ai_subreddits": None, "metrics": None})
+    results.sort(key=lambda result: result["line"])
+
+    states = [result["state"] for result in results]
+    summary = {
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started_at)),
+        "elapsed_seconds": round(time.time() - started_at, 2),
+        "config": {"specs": os.path.abspath(args.specs), "concurrency": app.MAX_CONCURRENT_JOBS, "reddit_requests_per_second": app.REDDIT_REQUESTS_PER_SECOND,
+                   "gemini_max_concurrent_calls": app.GEMINI_MAX_CONCURRENT_CALLS},
+        "totals": {state: states.count(state) for state in ("done", "failed", "cancelled")},
+        "cache": app.response_cache.get_stats(),
+        "jobs": results,
+    }
+    summary_path = args.summary or f"batch_summary_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"--- [批量] 完成 {summary['totals']['done']} 个，失败 {summary['totals']['failed']} 个，取消 {summary['totals']['cancelled']} 个，用时 {summary['elapsed_seconds']}s，汇总已写入 {summary_path} ---")
+    return 0 if summary["totals"]["done"] == len(specs) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+# --- 离线基准测试：用本地的 Reddit / Gemini 替身端到端运行 real_task_runner，输出各阶段耗时、吞吐量和内存峰值 ---
+# 用法示例:
+#   python benchmark.py --limits 10 30 --search-modes smart all_reddit --analysis-modes pain_points hot_topics --output bench.json
+#   python benchmark.py --compare bench.json        # 与上一次的结果逐项对比
+import os
+import sys
+import json
+import atexit
+import shutil
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+# 必须在导入 app 之前设置：不写任务快照、缓存放到临时目录，避免污染真实运行环境
+BENCH_TMP_DIR = tempfile.mkdtemp(prefix="reddit-analyzer-bench-")
+atexit.register(shutil.rmtree, BENCH_TMP_DIR, ignore_errors=True)
+os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+os.environ["JOB_PERSIST"] = "0"
+os.environ["CACHE_DB_PATH"] = os.path.join(BENCH_TMP_DIR, "cache.sqlite3")
+
+import app
+import praw
+from praw.endpoints import API_PATH
+
+FAKE_AI_SUBREDDITS = ["HomeImprovement", "InteriorDesign", "DIY", "Apartmentliving", "BuyItForLife", "IKEA"]
+BENCH_VOCABULARY = ["curtain", "rod", "blackout", "window", "light", "fabric", "hook", "install", "cheap", "broke",
+                    "ring", "track", "noise", "thermal", "linen", "sheer", "length", "hem", "wall", "bracket",
+                    "ceiling", "ikea", "amazon", "returned", "warranty", "shipping", "color", "faded", "wash", "wrinkle"]
+
+
+# --- 合成语料：按种子确定性生成帖子和评论树，同一参数每次生成的数据完全相同 ---
+def build_synthetic_corpus(seed, posts_per_subreddit, comments_per_post, more_ratio):
+    generated = {}
+
+    def generate(sub_name):
+        if sub_name not in generated:
+            generated[sub_name] = generate_subreddit(sub_name)
+        return generated[sub_name]
+
+    def generate_subreddit(sub_name):
+        rng = random.Random(f"{seed}:{sub_name}")
+        submissions = []
+        for i in range(posts_per_subreddit):
+            submission_id = f"{sub_name[:4]}{i:04d}"
+            created_utc = 1700000000 + rng.randrange(30 * 86400)
+            comments = []
+            for j in range(rng.randint(comments_per_post // 2, comments_per_post)):
+                parent_id = f"t3_{submission_id}" if j < 3 or rng.random() < 0.4 else f"t1_{comments[rng.randrange(len(comments))]['id']}"
+                if rng.random() < 0.03:
+                    body = "[deleted]"
+                elif comments and rng.random() < 0.08:
+                    body = comments[-1]["body"] + " this"  # 近似重复评论
+                else:
+                    body = " ".join(rng.choice(BENCH_VOCABULARY) for _ in range(rng.randint(2, 60)))
+                comments.append({"id": f"{submission_id}c{j:04d}", "parent_id": parent_id, "body": body, "score": int(rng.paretovariate(1.2)) - 1, "created_utc": created_utc + rng.randrange(7 * 86400),
+                                 "permalink": f"/r/{sub_name}/comments/{submission_id}/_/{submission_id}c{j:04d}/", "hidden": rng.random() < more_ratio})
+            submissions.append({"id": submission_id, "title": " ".join(rng.choice(BENCH_VOCABULARY) for _ in range(8)), "selftext": "",
+                                "score": int(rng.paretovariate(1.1) * 10), "created_utc": created_utc, "comments": comments})
+        return submissions
+    return generate
+
+
+# 录制语料格式: {"subreddits": {"名称": [{"id", "title", "selftext", "score", "created_utc", "comments": [{"id", "parent_id", "body", "score", "created_utc", "permalink"}]}]}}
+def load_recorded_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        recorded = json.load(f)["subreddits"]
+    return lambda sub_name: recorded.get(sub_name, [])
+
+
+# --- 替身后端：可配置的网络延迟与错误率 ---
+class FakeBackendError(Exception):
+    pass
+
+class FakeLatency:
+    def __init__(self, seconds, error_rate, seed):
+        self.seconds = seconds
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    def wait(self, what):
+        time.sleep(self.seconds * (0.5 + self.rng.random()))
+        if self.rng.random() < self.error_rate:
+            raise FakeBackendError(f"模拟的{what}错误")
+
+class FakeSubreddit:
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.name = name
+
+    def search(self, query, limit=100, sort='relevance', time_filter='all', params=None):
+        submissions = list(self.reddit.corpus_for(self.name))
+        if sort == 'top':
+            submissions.sort(key=lambda s: s["score"], reverse=True)
+        elif sort == 'new':
+            submissions.sort(key=lambda s: s["created_utc"], reverse=True)
+        else:
+            random.Random(f"{self.name}:{query}:{sort}").shuffle(submissions)
+        if params and params.get("after"):
+            after_id = params["after"][3:]
+            submissions = submissions[next(i for i, s in enumerate(submissions) if s["id"] == after_id) + 1:]
+        for i, submission in enumerate(submissions[:limit]):
+            # 与 PRAW 的列表生成器一样，每 100 条才真正请求一页
+            if i % app.REDDIT_PAGE_SIZE == 0:
+                self.reddit.latency.wait("搜索")
+            yield SimpleNamespace(**{key: value for key, value in submission.items() if key != "comments"})
+
+class FakeCommentForest:
+    def __init__(self, reddit, submission):
+        self.reddit = reddit
+        self.submission = submission
+
+    def list(self):
+        self.reddit.latency.wait("评论")
+        visible, hidden_by_parent = [], {}
+        for comment in self.submission["comments"]:
+            if comment["hidden"]:
+                hidden_by_parent.setdefault(comment["parent_id"], []).append(comment["id"])
+            else:
+                visible.append(SimpleNamespace(**comment))
+        more_nodes = [praw.models.MoreComments(self.reddit, {"count": len(children), "children": children, "parent_id": parent_id, "id": f"more_{parent_id}", "name": f"t1_more_{parent_id}", "depth": 0})
+                      for parent_id, children in hidden_by_parent.items()]
+        return visible + more_nodes
+
+class FakeReddit:
+    def __init__(self, corpus, latency):
+        self.corpus = corpus
+        self.latency = latency
+        self.submissions = {}
+
+    def corpus_for(self, sub_name):
+        for submission in self.corpus(sub_name):
+            self.submissions[submission["id"]] = submission
+            yield submission
+
+    def subreddit(self, name):
+        return FakeSubreddit(self, name)
+
+    def submission(self, id):
+        submission = self.submissions[id]
+        return SimpleNamespace(comments=FakeCommentForest(self, submission), comment_sort="confidence")
+
+    def post(self, path, data):
+        assert path == API_PATH["morechildren"]
+        self.latency.wait("展开评论")
+        submission = self.submissions[data["link_id"][3:]]
+        wanted = set(data["children"].split(","))
+        return [SimpleNamespace(**comment) for comment in submission["comments"] if comment["id"] in wanted]
+
+class FakeGenerativeModel:
+    def __init__(self, latency, seconds_per_1k_chars):
+        self.latency = latency
+        self.seconds_per_1k_chars = seconds_per_1k_chars
+
+    def generate_content(self, prompt):
+        time.sleep(len(prompt) / 1000 * self.seconds_per_1k_chars)
+        self.latency.wait("Gemini")
+        return SimpleNamespace(text=json.dumps(self.respond(prompt), ensure_ascii=False))
+
+    def respond(self, prompt):
+        if '"subreddits"' in prompt:
+            return {"subreddits": FAKE_AI_SUBREDDITS, "translations": {name: f"{name}版" for name in FAKE_AI_SUBREDDITS}}
+        if prompt.startswith("请将以下Reddit版块名翻译成中文"):
+            return {name.strip(): f"{name.strip()}版" for name in prompt.rsplit("：", 1)[-1].split(",")}
+        main_key = "identifiedPainPoints" if "identifiedPainPoints" in prompt else "keyDiscussionTopics"
+        example_key = "painPointTitle" if main_key == "identifiedPainPoints" else "associatedTopic"
+        summary = {"overallSentiment": "离线基准测试摘要", "keyFindings": ["发现一", "发现二"]}
+        if "--- 候选列表 ---" in prompt:
+            groups = {}
+            for line in prompt.split("--- 候选列表 ---", 1)[1].strip().splitlines():
+                candidate = json.loads(line)
+                groups.setdefault(candidate["title"], []).append(candidate["id"])
+            return {"executiveSummary": summary, main_key: [{"title": title, "description": "合并描述", "sourceIds": ids} for title, ids in groups.items()]}
+        comment_lines = [json.loads(line) for line in prompt.split("--- 原始评论数据 ---", 1)[1].strip().splitlines() if line.startswith("{")]
+        words = [word for comment in comment_lines for word in comment["body"].split() if word in BENCH_VOCABULARY]
+        top_words = sorted(set(words), key=words.count, reverse=True)[:5]
+        items = [{"title": f"{word} 相关问题", "description": "描述", "count": words.count(word)} for word in top_words]
+        examples = [{example_key: items[i % len(items)]["title"], "commentTranslation": comment["body"][:80], "score": comment["score"], "replies": comment["replies"], "permalink": comment["permalink"]}
+                    for i, comment in enumerate(comment_lines[:len(items)])] if items else []
+        if "这是全部评论中的第" in prompt:
+            return {main_key: items, "commentExamples": examples}
+        return {"executiveSummary": summary, main_key: items, "chartData": {"labels": [item["title"] for item in items], "data": [item["count"] for item in items], "colors": []}, "commentExamples": examples}
+
+
+# --- 单个场景：替换客户端后同步执行一次完整任务 ---
+# tracemalloc 会让纯 Python 代码慢一个数量级，因此计时的运行不开启内存追踪，内存峰值由单独的一次运行测量
+def run_scenario(args, corpus, limit, search_mode, analysis_mode, repeat_index, trace_memory=False):
+    seed = f"{args.seed}:{limit}:{search_mode}:{analysis_mode}:{repeat_index}"
+    reddit_latency = FakeLatency(args.reddit_latency, args.reddit_error_rate, f"reddit:{seed}")
+    gemini_latency = FakeLatency(args.gemini_latency, args.gemini_error_rate, f"gemini:{seed}")
+    # 替换共享客户端的构造函数并清空单例，每个场景都重新走一遍懒加载
+    app.build_reddit_client = lambda: FakeReddit(corpus, reddit_latency)
+    app.build_gemini_model = lambda: FakeGenerativeModel(gemini_latency, args.gemini_seconds_per_1k_chars)
+    app.shared_clients.clear()
+    app.reddit_rate_limiter = app.TokenBucket(args.reddit_qps, app.REDDIT_BURST)
+    if not args.warm_cache:
+        app.response_cache = app.DiskCache(os.path.join(BENCH_TMP_DIR, f"cache-{time.time_ns()}.sqlite3"), app.CACHE_MAX_BYTES)
+        app.ai_subreddits_memory.clear()
+        app.subreddit_translations.clear()
+
+    job_id = app.create_job()
+    if trace_memory:
+        tracemalloc.start()
+    started_at = time.perf_counter()
+    app.real_task_runner(job_id, args.keyword, "year", args.sort_order, limit, search_mode, list(app.DEFAULT_BLOCKED_KEYWORDS), analysis_mode)
+    wall_seconds = time.perf_counter() - started_at
+    peak_bytes = None
+    if trace_memory:
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    status = app.get_job_status(job_id)
+    if status.get("report_url"):
+        os.remove(os.path.join(app.app.static_folder, os.path.basename(status["report_url"])))
+    job_metrics = status.get("metrics", {"stage_seconds": {}, "counters": {}})
+    counters = job_metrics["counters"]
+    return {
+        "ok": status["state"] == "done",
+        "status": status["status"],
+        "wall_seconds": round(wall_seconds, 4),
+        "peak_memory_mb": round(peak_bytes / 1024 / 1024, 3) if peak_bytes is not None else None,
+        "posts_per_second": round(counters.get("posts_fetched", 0) / wall_seconds, 2),
+        "comments_per_second": round(counters.get("comments_fetched", 0) / wall_seconds, 2),
+        "stage_seconds": job_metrics["stage_seconds"],
+        # 并发调用的单次耗时：记录次数、单次最大值和累计调用秒数 (累计值可能超过 wall_seconds)
+        "call_seconds": {name: {"count": len(latencies), "max": max(latencies), "total": round(sum(latencies), 4)}
+                         for name, latencies in job_metrics.get("call_seconds", {}).items()},
+        "counters": counters,
+    }
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+def summarize(runs, memory_run):
+    summary = {key: median([run[key] for run in runs]) for key in ("wall_seconds", "posts_per_second", "comments_per_second")}
+    summary["peak_memory_mb"] = memory_run["peak_memory_mb"]
+    stage_names = sorted({name for run in runs for name in run["stage_seconds"]})
+    summary["stage_seconds"] = {name: round(median([run["stage_seconds"].get(name, 0) for run in runs]), 4) for name in stage_names}
+    call_names = sorted({name for run in runs for name in run["call_seconds"]})
+    summary["call_seconds"] = {name: {key: median([run["call_seconds"].get(name, {}).get(key, 0) for run in runs]) for key in ("count", "max", "total")} for name in call_names}
+    summary["counters"] = runs[-1]["counters"]
+    summary["failures"] = [run["status"] for run in runs + [memory_run] if not run["ok"]]
+    return summary
+
+def print_comparison(results, baseline):
+    print(f"\n{'场景':<36}{'指标':<22}{'基线':>12}{'本次':>12}{'变化':>10}")
+    for scenario, summary in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        rows = [(key, previous[key], summary[key]) for key in ("wall_seconds", "peak_memory_mb", "comments_per_second")]
+        rows += [(f"stage:{name}", previous["stage_seconds"].get(name, 0), seconds) for name, seconds in summary["stage_seconds"].items()]
+        for name, old, new in rows:
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{scenario:<36}{name:<22}{old:>12.4f}{new:>12.4f}{change:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="离线运行 real_task_runner 的基准测试 (不需要 Reddit 凭据或 Gemini 密钥)")
+    parser.add_argument("--limits", type=int, nargs="+", default=[10, 30])
+    parser.add_argument("--search-modes", nargs="+", default=["smart", "standard", "all_reddit"], choices=["smart", "standard", "all_reddit"])
+    parser.add_argument("--analysis-modes", nargs="+", default=["pain_points", "hot_topics"], choices=["pain_points", "hot_topics"])
+    parser.add_argument("--keyword", default="blackout curtain")
+    parser.add_argument("--sort-order", default="top", choices=["relevance", "hot", "top", "new"])
+    parser.add_argument("--repeat", type=int, default=3, help="每个场景重复次数，结果取中位数")
+    parser.add_argument("--seed", default="bench")
+    parser.add_argument("--corpus", help="录制的语料 JSON 文件；不指定时使用合成语料")
+    parser.add_argument("--posts-per-subreddit", type=int, default=150)
+    parser.add_argument("--comments-per-post", type=int, default=120)
+    parser.add_argument("--more-ratio", type=float, default=0.1, help="隐藏在 more 占位节点后的评论比例")
+    parser.add_argument("--reddit-latency", type=float, default=0.03, help="每次 Reddit 请求的平均延迟 (秒)")
+    parser.add_argument("--reddit-error-rate", type=float, default=0.0)
+    parser.add_argument("--reddit-qps", type=float, default=1000.0, help="共享令牌桶的速率；默认放开限制，只测本地开销")
+    parser.add_argument("--gemini-latency", type=float, default=0.2, help="每次 Gemini 调用的平均固定延迟 (秒)")
+    parser.add_argument("--gemini-seconds-per-1k-chars", type=float, default=0.005)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--warm-cache", action="store_true", help="场景之间保留磁盘缓存和 AI 推荐缓存")
+    parser.add_argument("--output", help="把结果写入 JSON 文件，供之后 --compare 使用")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_recorded_corpus(args.corpus)
+    else:
+        corpus = build_synthetic_corpus(args.seed, args.posts_per_subreddit, args.comments_per_post, args.more_ratio)
+    # 预先生成所有场景会用到的版块语料，避免把替身自身的开销算进耗时和内存峰值
+    for sub_name in FAKE_AI_SUBREDDITS + app.SUBREDDITS_TO_SEARCH.split('+') + ['all']:
+        corpus(sub_name)
+
+    results = {"created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0], "config": vars(args), "scenarios": {}}
+    for limit in args.limits:
+        for search_mode in args.search_modes:
+            for analysis_mode in args.analysis_modes:
+                scenario = f"limit={limit}/{search_mode}/{analysis_mode}"
+                runs = [run_scenario(args, corpus, limit, search_mode, analysis_mode, i) for i in range(args.repeat)]
+                memory_run = run_scenario(args, corpus, limit, search_mode, analysis_mode, args.repeat, trace_memory=True)
+                results["scenarios"][scenario] = summarize(runs, memory_run)
+                summary = results["scenarios"][scenario]
+                print(f"=== [基准] {scenario}: {summary['wall_seconds']:.3f}s, 峰值内存 {summary['peak_memory_mb']:.2f}MB, {summary['comments_per_second']:.0f} 评论/秒, 失败 {len(summary['failures'])} 次 ===")
+
+    print(f"\n{'场景':<36}{'阶段':<22}{'耗时(秒)':>12}")
+    for scenario, summary in results["scenarios"].items():
+        for name, seconds in summary["stage_seconds"].items():
+            print(f"{scenario:<36}{name:<22}{seconds:>12.4f}")
+
+    print(f"\n{'场景':<36}{'调用':<22}{'次数':>8}{'单次最大(秒)':>14}{'累计(秒)':>12}")
+    for scenario, summary in results["scenarios"].items():
+        for name, call in summary["call_seconds"].items():
+            print(f"{scenario:<36}{name:<22}{call['count']:>8}{call['max']:>14.4f}{call['total']:>12.4f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n--- 结果已写入 {args.output} ---")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const timeframeSelect = document.getElementById('timeframe');
     
     let pollingInterval;
+    let eventSource;
+    let currentJobId = null;
     let aiBoxShown = false;
 
     // --- 动态屏蔽词功能 ---
@@ -82,6 +84,7 @@ document.addEventListener('DOMContentLoaded', function() {
             subreddits: document.getElementById('subreddits').value,
             limit: document.getElementById('limit').value,
             analysis_mode: document.getElementById('analysis_mode').value,
+            incremental: document.getElementById('incremental').checked,
             blocked_keywords: currentBlockedKeywords
         };
 
@@ -107,80 +110,122 @@ document.addEventListener('DOMContentLoaded', function() {
             body: JSON.stringify(taskData),
         })
         .then(response => {
+            if (response.status === 429) {
+                // 后端排队已满，直接把提示展示给用户
+                return response.json().then(data => {
+                    const busyError = new Error(data.message);
+                    busyError.showToUser = true;
+                    throw busyError;
+                });
+            }
             if (!response.ok) throw new Error('网络响应不正常');
             return response.json();
         })
         .then(data => {
-            console.log("--- 任务已在后端成功启动，准备开始轮询 ---", data.message);
-            // 清除可能存在的上一次的定时器
-            if(pollingInterval) clearInterval(pollingInterval);
-            // 启动新的定时器
-            pollingInterval = setInterval(checkStatus, 1500);
+            console.log("--- 任务已在后端成功启动，准备开始轮询 ---", data.message, data.job_id);
+            currentJobId = data.job_id;
+            // 清除可能存在的上一次的推送连接和定时器
+            stopTracking();
+            // 优先使用服务器推送，不支持时回退到轮询
+            if (window.EventSource) {
+                startStreaming();
+            } else {
+                startPolling();
+            }
         })
         .catch(error => {
             console.error("!!! 启动任务时发生fetch错误:", error);
-            progressText.innerText = '启动任务失败，请检查后端服务或网络。';
+            progressText.innerText = error.showToUser ? error.message : '启动任务失败，请检查后端服务或网络。';
         });
     });
 
+    function stopTracking() {
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
+        if (pollingInterval) clearInterval(pollingInterval);
+    }
+
+    function startPolling() {
+        pollingInterval = setInterval(checkStatus, 1500);
+    }
+
+    /**
+     * 通过 Server-Sent Events 接收后台实时推送的任务状态，连接失败时回退到轮询
+     */
+    function startStreaming() {
+        eventSource = new EventSource(`/task-events/${currentJobId}`);
+        eventSource.onmessage = (event) => renderStatus(JSON.parse(event.data));
+        eventSource.onerror = () => {
+            if (!eventSource) return;
+            console.warn("--- 推送连接不可用，回退到轮询 ---");
+            eventSource.close();
+            eventSource = null;
+            startPolling();
+        };
+    }
+
     /**
      * 关键函数：检查后台任务状态并更新UI
      */
     function checkStatus() {
-        fetch('/task-status')
+        fetch(`/task-status/${currentJobId}`)
             .then(response => {
                 if (!response.ok) throw new Error('查询状态失败');
                 return response.json();
             })
-            .then(data => {
-                progressText.innerText = data.status;
-                progressBar.style.width = data.progress + '%';
-
-                if (data.ai_subreddits && !aiBoxShown) {
-                    const aiList = document.getElementById('ai-subreddits-list');
-                    if (aiList) {
-                        aiList.innerHTML = '';
-                        data.ai_subreddits.forEach(sub => {
-                            const listItem = document.createElement('li');
-                            listItem.textContent = `r/${sub.name} (${sub.translation})`;
-                            aiList.appendChild(listItem);
-                        });
-                        const aiBox = document.getElementById('ai-recommendation-box');
-                        aiBox.classList.remove('hidden');
-                        setTimeout(() => aiBox.classList.add('visible'), 50);
-                        aiBoxShown = true;
-                    }
-                }
-
-                if (data.progress >= 100) {
-                    clearInterval(pollingInterval);
-                    if (data.report_url) {
-                        viewReportButton.href = data.report_url;
-                        viewReportButton.target = "_blank";
-                        viewReportButton.textContent = "点击查看洞察报告";
-                        viewReportButton.style.backgroundColor = "";
-                        viewReportButton.style.cursor = "";
-
-                    } else {
-                        viewReportButton.href = "#";
-                        viewReportButton.textContent = "生成报告失败";
-                        viewReportButton.style.backgroundColor = "#888";
-                        viewReportButton.style.cursor = "not-allowed";
-                    }
-                    setTimeout(() => {
-                        progressContainer.classList.add('hidden');
-                        const aiBox = document.getElementById('ai-recommendation-box');
-                        if(aiBox) aiBox.classList.add('hidden');
-                        resultContainer.classList.remove('hidden');
-                    }, 500);
-                }
-            })
+            .then(renderStatus)
             .catch(error => {
                 console.error('查询状态时出错:', error);
-                clearInterval(pollingInterval);
+                stopTracking();
                 progressText.innerText = '查询进度失败，连接可能已断开。';
             });
     }
+
+    function renderStatus(data) {
+        progressText.innerText = data.status;
+        progressBar.style.width = data.progress + '%';
+
+        if (data.ai_subreddits && !aiBoxShown) {
+            const aiList = document.getElementById('ai-subreddits-list');
+            if (aiList) {
+                aiList.innerHTML = '';
+                data.ai_subreddits.forEach(sub => {
+                    const listItem = document.createElement('li');
+                    listItem.textContent = `r/${sub.name} (${sub.translation})`;
+                    aiList.appendChild(listItem);
+                });
+                const aiBox = document.getElementById('ai-recommendation-box');
+                aiBox.classList.remove('hidden');
+                setTimeout(() => aiBox.classList.add('visible'), 50);
+                aiBoxShown = true;
+            }
+        }
+
+        if (data.progress >= 100) {
+            stopTracking();
+            if (data.report_url) {
+                viewReportButton.href = data.report_url;
+                viewReportButton.target = "_blank";
+                viewReportButton.textContent = "点击查看洞察报告";
+                viewReportButton.style.backgroundColor = "";
+                viewReportButton.style.cursor = "";
+
+            } else {
+                viewReportButton.href = "#";
+                viewReportButton.textContent = "生成报告失败";
+                viewReportButton.style.backgroundColor = "#888";
+                viewReportButton.style.cursor = "not-allowed";
+            }
+            setTimeout(() => {
+                progressContainer.classList.add('hidden');
+                const aiBox = document.getElementById('ai-recommendation-box');
+                if(aiBox) aiBox.classList.add('hidden');
+                resultContainer.classList.remove('hidden');
+            }, 500);
+        }
+    }
     
     // --- 页面加载时初始化 ---
     renderBlocklistTags();